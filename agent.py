@@ -1,104 +1,241 @@
-# OpenAI model
-from langchain_openai import ChatOpenAI
-
 # Prompts
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 # Agents and methods
-from langchain.agents import AgentExecutor
-from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
-from langchain.agents.format_scratchpad.openai_functions import (
-    format_to_openai_functions,
+from langchain.agents.agent import RunnableMultiActionAgent
+from langchain.agents.output_parsers.openai_tools import (
+    OpenAIToolAgentAction,
+    OpenAIToolsAgentOutputParser,
+)
+from langchain.agents.format_scratchpad.openai_tools import (
+    format_to_openai_tool_messages,
 )
 
 # Schemas
-from langchain.schema.runnable import RunnablePassthrough
+from langchain.schema.runnable import RunnableLambda, RunnablePassthrough
 
 # Function calling
-from langchain_core.utils.function_calling import convert_to_openai_function
+from langchain_core.utils.function_calling import convert_to_openai_tool
 
 # Memory
 from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_community.chat_message_histories import ChatMessageHistory
-
-# Streamlit
-import streamlit as st
 
 # Others
-import random
+import json
+import uuid
 
 # Custom tools and prompts
 from templates.prompts import newsbot_prompt
-from utils.tools import answer_search, news_search, webpage_retriever
-
-tools = [answer_search, news_search]
+from utils.tools import (
+    answer_search,
+    archive_search,
+    get_api_headlines,
+    multi_search,
+    news_search,
+    webpage_retriever,
+)
+from utils.reduce import context_reducer
+from utils.streaming import AGENT_LLM_TAG
+from utils.memory import make_history_store, summarise_messages
+from utils.resources import chat_model, shared
+from utils.metrics import AGENT_EXECUTOR_TAG, metrics_handler, start_metrics_server
+from utils.config import setting
+from utils.semantic_cache import semantic_cache
+from utils.router import router
+from utils.cache import cached_functions
+from utils.parallel import ParallelAgentExecutor
+
+tools = [
+    archive_search,
+    answer_search,
+    news_search,
+    multi_search,
+    get_api_headlines,
+    webpage_retriever,
+]
 
 
 # # MODEL AND PROMPT
-model = ChatOpenAI(
-    model_name="gpt-3.5-turbo-1106",
-    temperature=0,
-    openai_api_key=st.secrets["openai_api_key"],
-)
-functions = [convert_to_openai_function(f) for f in tools]
-model_functions = model.bind(functions=functions)
-prompt = ChatPromptTemplate.from_messages(
-    [
-        (
-            "system",
-            newsbot_prompt,
-        ),
-        MessagesPlaceholder(variable_name="history"),
-        ("human", "{input}"),
-        MessagesPlaceholder(variable_name="agent_scratchpad"),
+# Everything below is built once per process and shared by all sessions
+model = chat_model("gpt-3.5-turbo-1106", temperature=0, tags=(AGENT_LLM_TAG,))
+
+
+# The tools protocol lets the model ask for several tool calls in one step, e.g. one search per subject
+@shared
+def build_model_tools():
+    return model.bind(tools=[convert_to_openai_tool(t) for t in tools])
+
+
+@shared
+def build_prompt():
+    return ChatPromptTemplate.from_messages(
+        [
+            (
+                "system",
+                newsbot_prompt,
+            ),
+            MessagesPlaceholder(variable_name="history"),
+            ("human", "{input}"),
+            MessagesPlaceholder(variable_name="agent_scratchpad"),
+        ]
+    )
+
+
+# # FAST-PATH ROUTER
+# Obvious first tool calls ("latest news about X", "who is X") are predicted locally, saving the first LLM call
+def route_action(route):
+    """The agent actions the model would have returned for this route."""
+    tool_call = {
+        "id": f"call_{uuid.uuid4().hex[:24]}",
+        "type": "function",
+        "function": {"name": route.tool, "arguments": json.dumps(route.tool_input)},
+    }
+    return [
+        OpenAIToolAgentAction(
+            tool=route.tool,
+            tool_input=route.tool_input,
+            log=f"\nInvoking: `{route.tool}` with `{route.tool_input}` (routed: {route.reason})\n\n\n",
+            message_log=[
+                AIMessage(content="", additional_kwargs={"tool_calls": [tool_call]})
+            ],
+            tool_call_id=tool_call["id"],
+        )
     ]
-)
 
-# # BASIC CHAIN AND AGENT
 
-agent_chain = (
-    RunnablePassthrough.assign(
-        agent_scratchpad=lambda x: format_to_openai_functions(x["intermediate_steps"])
+def plan_first_step(planner):
+    def plan(x):
+        if x["intermediate_steps"]:
+            return planner
+        # Callers that already know the first call, such as batch runs, pass it in as "route"
+        if x.get("route") is not None:
+            return route_action(x["route"])
+        route, path = router.decide(x["input"], x.get("history") or ())
+        if path == "direct":
+            return route_action(route)
+        if path == "speculative":
+            # Start the likely search now; if the model asks for it too, it joins the fetch or hits the cache
+            cached_functions[route.tool].warm(**route.tool_input)
+        return planner
+
+    return RunnableLambda(plan)
+
+
+# # BASIC CHAIN AND AGENT
+@shared
+def build_agent_executor():
+    planner = (
+        RunnablePassthrough.assign(
+            agent_scratchpad=lambda x: format_to_openai_tool_messages(
+                context_reducer.reduce_steps(x["intermediate_steps"])
+            )
+        )
+        | build_prompt()
+        | build_model_tools()
+        | OpenAIToolsAgentOutputParser()
     )
-    | prompt
-    | model_functions
-    | OpenAIFunctionsAgentOutputParser()
-)
+    # All tool calls of a step run at once, and their results go back to the model in one call
+    return ParallelAgentExecutor(
+        agent=RunnableMultiActionAgent(runnable=plan_first_step(planner)),
+        tools=tools,
+        verbose=True,
+        tags=[AGENT_EXECUTOR_TAG],
+    )
+
+
+agent_executor = build_agent_executor()
 
-agent_executor = AgentExecutor(agent=agent_chain, tools=tools, verbose=True)
 
 # # MEMORY MANAGEMENT
-store = st.session_state
+# Older turns are folded into a rolling summary so the prompt stays the same size however long the chat gets
+@shared
+def build_history_store():
+    summariser = chat_model("gpt-3.5-turbo-1106", temperature=0)
+    return make_history_store(
+        summarise=lambda summary, messages: summarise_messages(
+            summariser, summary, messages
+        )
+    )
 
 
-def get_session_history(session_id: str) -> BaseChatMessageHistory:
-    if session_id not in store:
-        store[session_id] = ChatMessageHistory()
-        # adds a new entry to the `store` dictionary with the session ID as the key and an instance of `ChatMessageHistory` as the value, i.e. a tuple containing an attribute 'messages' which is an empty list of messages.
+history_store = build_history_store()
+
 
-    return store[session_id]
+def get_session_history(session_id: str) -> BaseChatMessageHistory:
+    return history_store.history(session_id)
 
 
 def gen_session_id():
-    session_id = random.randint(100000, 999999)
-    return str(session_id)
+    return uuid.uuid4().hex
+
+
+# # AGENT WITH MEMORY
+@shared
+def build_agent_with_message_history():
+    # Callbacks in the config are inherited, so every LLM and tool call of the turn is timed
+    return RunnableWithMessageHistory(
+        agent_executor.with_config(callbacks=[metrics_handler]),
+        get_session_history,
+        input_messages_key="input",
+        history_messages_key="history",
+    )
 
 
-def reset_session(current_session_id):
-    del st.session_state[current_session_id]
-    current_session_id = gen_session_id()
-    return current_session_id
+agent_with_message_history = build_agent_with_message_history()
 
 
-# # Initialise session
-current_session_id = gen_session_id
+# # SEMANTIC CACHE
+def question_intent(question):
+    """The tool the router expects the question to need, so a factual answer is never served for news."""
+    route = router.route(question)
+    return route.tool if route else None
 
 
-# # AGENT WITH MEMORY
-agent_with_message_history = RunnableWithMessageHistory(
-    agent_executor,
-    get_session_history,
-    input_messages_key="input",
-    history_messages_key="history",
-)
+def cached_answer(session_id, question, history=()):
+    """A recent answer to a near-identical question in the same conversation (`history`, the messages before it),
+    added to the session's history as if the agent gave it."""
+    entry = semantic_cache.lookup(question, question_intent(question), history)
+    if entry is not None:
+        get_session_history(session_id).add_messages(
+            [HumanMessage(content=question), AIMessage(content=entry["answer"])]
+        )
+    return entry
+
+
+def remember_answer(question, answer, steps=(), history=()):
+    """Cache the agent's answer for similar questions, unless one of its tools failed."""
+    if any(
+        str(observation).startswith("An error has occurred") for _, observation in steps
+    ):
+        return
+    semantic_cache.add(question, answer, question_intent(question), history)
+
+
+# # METRICS
+# Each worker process serves its own metrics, on metrics_port or the next free port after it
+@shared
+def build_metrics_server():
+    port = setting("metrics_port", "9464")
+    if port == "off":
+        return None
+    return start_metrics_server(int(port))
+
+
+metrics_server = build_metrics_server()
+
+
+# # PREFETCH
+# Country headlines and frequent searches are refreshed in the background; with the "worker" setting,
+# `python -m utils.prefetch` does it instead for every app process on the host
+@shared
+def build_prefetcher():
+    from utils.prefetch import PREFETCH_MODE, Prefetcher
+
+    if PREFETCH_MODE != "app":
+        return None
+    return Prefetcher().start()
+
+
+prefetcher = build_prefetcher()
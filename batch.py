@@ -0,0 +1,217 @@
+"""Run many questions through the agent without the UI, e.g. for a nightly digest.
+
+Each line of the queries file is a topic, a question or a two-letter country code; blank lines and lines
+starting with # are skipped. Results are appended to a JSONL file as each query finishes:
+
+    python batch.py topics.txt --out digest.jsonl --concurrency 16
+    python batch.py topics.txt --out digest.jsonl --resume
+
+With --resume, queries that already have a successful result in the output file are not run again.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# The app's background prefetcher has no place in a batch run
+os.environ.setdefault("NEWSBOT_PREFETCH", "off")
+
+from agent import agent_executor
+from utils.metrics import MetricsCallbackHandler, metrics_handler
+from utils.parallel import TOOL_WORKERS
+from utils.ratelimit import BATCH, request_priority
+from utils.router import COUNTRY_CODES, Route
+from utils.semantic_cache import citations
+
+TOPIC_QUESTION = "Summarise the latest news about {query}, with the sources."
+COUNTRY_QUESTION = (
+    "What's the news in {country}? Summarise the top stories, with the sources."
+)
+# The longest of the names for each code is the full one: "united states" rather than "us"
+COUNTRY_NAMES = {}
+for name, code in sorted(COUNTRY_CODES.items(), key=lambda item: len(item[0])):
+    COUNTRY_NAMES[code] = name
+
+
+class QueryTimings(MetricsCallbackHandler):
+    """Totals the timings of one query by kind, and counts the tools it called."""
+
+    def __init__(self):
+        super().__init__()
+        self.seconds = defaultdict(float)
+        self.counts = Counter()
+        self.tools = Counter()
+        self.tokens = Counter()
+
+    def observe(self, kind, name, seconds, **labels):
+        with self._lock:
+            self.seconds[kind] += seconds
+            self.counts[kind] += 1
+            if kind == "tool":
+                self.tools[name] += 1
+
+    def count_tokens(self, model, prompt, completion):
+        with self._lock:
+            self.tokens["prompt"] += prompt
+            self.tokens["completion"] += completion
+
+
+def read_queries(path):
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return list(dict.fromkeys(l for l in lines if l and not l.startswith("#")))
+
+
+def question_for(query):
+    """The question asked of the agent: country codes ask for the country's headlines."""
+    country = COUNTRY_NAMES.get(query.lower())
+    if country is not None:
+        return COUNTRY_QUESTION.format(country=country.title())
+    if query.rstrip().endswith("?"):
+        return query
+    return TOPIC_QUESTION.format(query=query)
+
+
+def route_for(query):
+    """The first tool call of a topic or country code, made without the router.
+
+    The router would read the instructions in the question as part of the topic; questions are routed as usual.
+    """
+    code = query.lower()
+    if code in COUNTRY_NAMES:
+        return Route("get_api_headlines", {"countrycode": code}, 1.0, "batch country")
+    if query.rstrip().endswith("?"):
+        return None
+    return Route("news_search", {"query": query}, 1.0, "batch topic")
+
+
+def finished_queries(path):
+    """Queries with a successful result in an earlier run's output."""
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line of an interrupted run may be cut short
+                continue
+            if not record.get("error"):
+                done.add(record["query"])
+    return done
+
+
+def ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+async def run_query(query, limit, timeout):
+    """Answer one query on the agent; returns its result record, with the error instead if it failed."""
+    # Every query runs in a task of its own, so this puts just its requests behind interactive users'
+    request_priority.set(BATCH)
+    async with limit:
+        question = question_for(query)
+        timings = QueryTimings()
+        started = time.perf_counter()
+        record = {"query": query, "question": question}
+        try:
+            # No history: every query stands alone, and batch runs leave the chat history store alone
+            result = await asyncio.wait_for(
+                agent_executor.ainvoke(
+                    {"input": question, "history": [], "route": route_for(query)},
+                    config={"callbacks": [metrics_handler, timings], "tags": ["batch"]},
+                ),
+                timeout,
+            )
+            record.update(
+                answer=result["output"],
+                sources=citations(result["output"]),
+                error=None,
+            )
+        except Exception as e:
+            record.update(answer=None, sources=[], error=repr(e))
+        record.update(
+            seconds=round(time.perf_counter() - started, 3),
+            timings={
+                "llm_seconds": round(timings.seconds["llm"], 3),
+                "tool_seconds": round(timings.seconds["tool"], 3),
+                "iterations": timings.counts["iteration"],
+                "llm_calls": timings.counts["llm"],
+            },
+            tools=dict(timings.tools),
+            tokens=dict(timings.tokens),
+            finished_at=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        )
+        return record
+
+
+async def run_batch(queries, out, concurrency, timeout):
+    # Tools are synchronous and run on the loop's default executor, so it needs room for every query's tool calls
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(
+        ThreadPoolExecutor(
+            max_workers=concurrency * TOOL_WORKERS, thread_name_prefix="batch-tool"
+        )
+    )
+    limit = asyncio.Semaphore(concurrency)
+    tasks = [run_query(query, limit, timeout) for query in queries]
+    failed = 0
+    for done, task in enumerate(asyncio.as_completed(tasks), 1):
+        record = await task
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out.flush()
+        failed += bool(record["error"])
+        status = f"failed: {record['error']}" if record["error"] else "ok"
+        print(
+            f"[{done}/{len(queries)}] {record['query']} ({record['seconds']:.1f}s) {status}"
+        )
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Answer a file of topics, questions or country codes with the agent, as JSONL."
+    )
+    parser.add_argument("queries", help="text file with one query per line")
+    parser.add_argument("--out", default="digest.jsonl")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="seconds allowed per query"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip queries already answered in --out and append to it",
+    )
+    args = parser.parse_args()
+
+    queries = read_queries(args.queries)
+    if args.resume:
+        done = finished_queries(args.out)
+        queries = [q for q in queries if q not in done]
+        print(f"Resuming: {len(done)} queries already answered")
+
+    started = time.perf_counter()
+    with open(args.out, "a" if args.resume else "w", encoding="utf-8") as out:
+        if out.tell() and not ends_with_newline(args.out):
+            # Start after the interrupted run's partial last line, not on it
+            out.write("\n")
+        failed = asyncio.run(run_batch(queries, out, args.concurrency, args.timeout))
+    elapsed = time.perf_counter() - started
+    print(
+        f"{len(queries) - failed} of {len(queries)} queries answered in {elapsed:.1f}s "
+        f"({len(queries) / elapsed * 60 if elapsed else 0:.1f}/min), {failed} failed"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,255 @@
+"""Drive the agent end to end against local stubs and report turn latency, tool latency, LLM usage and throughput.
+
+Runs offline from the repository root; nothing is sent to Brave, NewsAPI or OpenAI:
+
+    python benchmarks/agent_bench.py --sessions 4 --turns 3
+    python benchmarks/agent_bench.py --save baseline.json
+    python benchmarks/agent_bench.py --compare baseline.json --tolerance 0.15
+
+With --compare the exit code is 1 when latency or throughput regressed by more than the tolerance.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stubs import StubUpstreams, parse_pairs
+
+# Lower is better for these, higher is better for throughput
+LATENCY_METRICS = ["turn_p50", "turn_p95", "turn_p99"]
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def make_recorder():
+    """A callback handler collecting LLM calls, tokens and tool latencies, per turn."""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    from utils.reduce import count_tokens
+
+    class Recorder(BaseCallbackHandler):
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.started = {}
+            self.prompts = {}
+            self.llm_calls = 0
+            self.tokens = 0
+            self.tools = defaultdict(list)
+            self.tool_errors = 0
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            prompt = sum(count_tokens(str(m.content)) for m in messages[0])
+            with self.lock:
+                self.llm_calls += 1
+                self.prompts[run_id] = prompt
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            # The agent streams, and streamed completions carry no usage, so count the tokens ourselves
+            usage = (response.llm_output or {}).get("token_usage", {})
+            tokens = usage.get("total_tokens")
+            if tokens is None:
+                generation = response.generations[0][0]
+                tokens = self.prompts.pop(run_id, 0) + count_tokens(
+                    generation.text + str(generation.message.additional_kwargs)
+                )
+            with self.lock:
+                self.tokens += tokens
+
+        def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+            self.started[run_id] = (serialized["name"], time.perf_counter())
+
+        def on_tool_end(self, output, *, run_id, **kwargs):
+            name, started = self.started.pop(run_id, (None, None))
+            if name is not None:
+                with self.lock:
+                    self.tools[name].append(time.perf_counter() - started)
+                    # The tools catch their own exceptions and return an error message instead
+                    self.tool_errors += str(output).startswith("An error has occurred")
+
+        on_tool_error = on_tool_end
+
+    return Recorder
+
+
+def run_session(agent, recorder_class, queries, session, turns):
+    """Run `turns` turns of one simulated session; return one record per turn."""
+    session_id = f"bench-{session}-{os.getpid()}"
+    records = []
+    for turn in range(turns):
+        query = queries[(session + turn) % len(queries)]
+        recorder = recorder_class()
+        started = time.perf_counter()
+        error = None
+        try:
+            agent.agent_with_message_history.invoke(
+                {"input": query},
+                config={
+                    "configurable": {"session_id": session_id},
+                    "callbacks": [recorder],
+                },
+            )
+        except Exception as e:
+            error = str(e)
+        records.append(
+            {
+                "seconds": time.perf_counter() - started,
+                "llm_calls": recorder.llm_calls,
+                "tokens": recorder.tokens,
+                "tools": dict(recorder.tools),
+                "tool_errors": recorder.tool_errors,
+                "error": error,
+            }
+        )
+    return records
+
+
+def summarise(records, wall_seconds):
+    turns = [r["seconds"] for r in records if r["error"] is None]
+    tools = defaultdict(list)
+    for r in records:
+        for name, seconds in r["tools"].items():
+            tools[name].extend(seconds)
+    return {
+        "turns": len(records),
+        "errors": sum(r["error"] is not None for r in records),
+        "tool_errors": sum(r["tool_errors"] for r in records),
+        "turn_p50": percentile(turns, 50),
+        "turn_p95": percentile(turns, 95),
+        "turn_p99": percentile(turns, 99),
+        "throughput": len(turns) / wall_seconds if wall_seconds else 0.0,
+        "llm_calls_per_turn": statistics.mean(r["llm_calls"] for r in records),
+        "tokens_per_turn": statistics.mean(r["tokens"] for r in records),
+        "tools": {
+            name: {
+                "calls": len(seconds),
+                "p50": percentile(seconds, 50),
+                "p95": percentile(seconds, 95),
+            }
+            for name, seconds in sorted(tools.items())
+        },
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Regressions of `report` against `baseline` beyond `tolerance`, as printable lines."""
+    regressions = []
+    for metric in LATENCY_METRICS:
+        if report[metric] > baseline[metric] * (1 + tolerance):
+            regressions.append(
+                f"{metric}: {baseline[metric]:.3f}s -> {report[metric]:.3f}s"
+            )
+    if report["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(
+            f"throughput: {baseline['throughput']:.2f}/s -> {report['throughput']:.2f}/s"
+        )
+    return regressions
+
+
+def print_report(report):
+    print(
+        f"{report['turns']} turns, {report['errors']} errors, "
+        f"{report['tool_errors']} failed tool calls, "
+        f"{report['throughput']:.2f} turns/s"
+    )
+    print(
+        f"turn latency p50 {report['turn_p50']:.3f}s  p95 {report['turn_p95']:.3f}s  "
+        f"p99 {report['turn_p99']:.3f}s"
+    )
+    print(
+        f"per turn: {report['llm_calls_per_turn']:.1f} LLM calls, "
+        f"{report['tokens_per_turn']:.0f} tokens"
+    )
+    for name, stats in report["tools"].items():
+        print(
+            f"  {name:<22} {stats['calls']:>4} calls  p50 {stats['p50']:.3f}s  "
+            f"p95 {stats['p95']:.3f}s"
+        )
+    print(f"cache: {report['cache']}")
+    if report["throttled"]:
+        print(f"429s from the stubs: {report['throttled']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--latency", help="e.g. brave=0.3,newsapi=0.4,openai=0.8")
+    parser.add_argument("--errors", help="error rate per upstream, e.g. brave=0.05")
+    parser.add_argument(
+        "--limits", help="stub rate limits in requests per second, e.g. brave=5"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--split-functions",
+        action="store_true",
+        help="with the functions protocol, have the stub model call a tool per subject",
+    )
+    parser.add_argument("--save", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    stubs = StubUpstreams(
+        latency=parse_pairs(args.latency),
+        errors=parse_pairs(args.errors),
+        seed=args.seed,
+        limits=parse_pairs(args.limits),
+        split_functions=args.split_functions,
+    )
+    stubs.start()
+    # Settings are read at import time, so the environment must be ready before agent is imported
+    os.environ.update(stubs.env())
+    os.environ["NEWSBOT_DATA_DIR"] = tempfile.mkdtemp(prefix="newsbot-bench-")
+    os.environ.setdefault("NEWSBOT_METRICS_PORT", "off")
+    os.environ.setdefault("NEWSBOT_PREFETCH", "off")
+
+    import agent
+    from utils.cache import tool_cache
+
+    recorder_class = make_recorder()
+    queries = stubs.fixtures["queries"]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.sessions) as pool:
+        futures = [
+            pool.submit(
+                run_session, agent, recorder_class, queries, session, args.turns
+            )
+            for session in range(args.sessions)
+        ]
+        records = [r for f in futures for r in f.result()]
+    report = summarise(records, time.perf_counter() - started)
+    report["cache"] = tool_cache.stats()
+    report["upstream_requests"] = dict(stubs.requests)
+    report["throttled"] = dict(stubs.throttled)
+    report["config"] = vars(args)
+    stubs.stop()
+
+    print_report(report)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
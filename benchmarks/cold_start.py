@@ -0,0 +1,81 @@
+"""Measure import time and memory of newsbot's modules, each in a fresh interpreter.
+
+Run from the repository root (agent.py reads .streamlit/secrets.toml when imported):
+
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --json cold_start.json
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+MODULES = [
+    "streamlit",
+    "langchain_core",
+    "langchain.agents",
+    "langchain_openai",
+    "newspaper",
+    "wikipedia",
+    "tiktoken",
+    "utils.tools",
+    "agent",
+]
+
+PROBE = """
+import json, resource, sys, time
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    "seconds": elapsed,
+    "added_rss_mb": (rss_after - rss_before) / 2**10,
+    "max_rss_mb": rss_after / 2**10,
+    "modules_loaded": len(sys.modules),
+}}))
+"""
+
+
+def measure(module, repeat):
+    """Best of `repeat` cold imports of `module`."""
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module)],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1]}
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return min(runs, key=lambda r: r["seconds"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'module':<20} {'seconds':>8} {'+RSS MB':>8} {'RSS MB':>8} {'modules':>8}")
+    for module in args.modules:
+        result = results[module] = measure(module, args.repeat)
+        if "error" in result:
+            print(f"{module:<20} {result['error']}")
+            continue
+        print(
+            f"{module:<20} {result['seconds']:>8.2f} {result['added_rss_mb']:>8.1f}"
+            f" {result['max_rss_mb']:>8.1f} {result['modules_loaded']:>8}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
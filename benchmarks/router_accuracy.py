@@ -0,0 +1,70 @@
+"""Measure how often the intent router picks the tool a labelled query should use.
+
+    python benchmarks/router_accuracy.py
+    python benchmarks/router_accuracy.py --min-precision 0.95 --verbose
+
+Reports accuracy of the predicted tool, then coverage and precision of the direct (no LLM call) and speculative
+paths. Queries may carry a "history" of earlier messages, to test follow-ups. With --min-precision the exit code is 1 when direct routes are less precise than that.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUERIES = os.path.join(os.path.dirname(__file__), "routing_queries.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("queries", nargs="?", default=QUERIES)
+    parser.add_argument("--min-precision", type=float)
+    parser.add_argument("--verbose", action="store_true", help="list every mistake")
+    args = parser.parse_args()
+
+    from utils.router import router
+
+    with open(args.queries) as f:
+        labelled = json.load(f)
+
+    correct = 0
+    paths = Counter()
+    path_correct = Counter()
+    confusion = Counter()
+    started = time.perf_counter()
+    for item in labelled:
+        # Follow-ups carry the earlier messages of their chat
+        route, path = router.decide(item["query"], item.get("history", ()))
+        predicted = route.tool if route else "none"
+        hit = predicted == item["tool"]
+        correct += hit
+        paths[path] += 1
+        path_correct[path] += hit
+        confusion[(item["tool"], predicted)] += 1
+        if args.verbose and not hit:
+            print(f"  {path:<11} {item['tool']:<18} -> {predicted:<18} {item['query']}")
+    per_query = (time.perf_counter() - started) / len(labelled)
+
+    print(f"{len(labelled)} queries, {per_query * 1e6:.0f} µs per routing decision")
+    print(f"tool accuracy: {correct / len(labelled):.1%}")
+    for path in ("direct", "speculative", "model"):
+        if paths[path]:
+            print(
+                f"{path:<11} coverage {paths[path] / len(labelled):.1%}  "
+                f"precision {path_correct[path] / paths[path]:.1%}"
+            )
+    print("confusion (expected -> predicted: count):")
+    for (expected, predicted), count in sorted(confusion.items()):
+        print(f"  {expected:<18} -> {predicted:<18} {count}")
+
+    if args.min_precision is not None and paths["direct"]:
+        precision = path_correct["direct"] / paths["direct"]
+        sys.exit(1 if precision < args.min_precision else 0)
+
+
+if __name__ == "__main__":
+    main()
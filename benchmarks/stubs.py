@@ -0,0 +1,374 @@
+"""Local stand-ins for Brave, NewsAPI, news article pages and the OpenAI chat API.
+
+The stubs replay benchmarks/fixtures.json with configurable latency, error injection and per-upstream rate
+limits answered with 429s, so newsbot can be benchmarked offline. Run standalone to point a local Streamlit app at them:
+
+    python benchmarks/stubs.py --port 8765 --latency brave=0.3,newsapi=0.4,openai=0.8
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures.json")
+DEFAULT_LATENCY = {"brave": 0.3, "newsapi": 0.4, "articles": 0.5, "openai": 0.8}
+TOKEN_DELAY = 0.01  # seconds between streamed completion tokens
+COUNTRY_CODES = {"singapore": "sg", "malaysia": "my", "india": "in", "japan": "jp"}
+URL_RE = re.compile(r"https?://[^\s'\"\\\],)]+")
+
+
+def parse_pairs(text, cast=float):
+    """Parse "brave=0.3,openai=0.8" into a dict."""
+    pairs = {}
+    for pair in filter(None, (text or "").split(",")):
+        name, value = pair.split("=")
+        pairs[name.strip()] = cast(value)
+    return pairs
+
+
+class StubUpstreams:
+    """One HTTP server answering for every upstream under its own path prefix."""
+
+    def __init__(
+        self,
+        fixtures_path=FIXTURES,
+        latency=None,
+        errors=None,
+        seed=None,
+        limits=None,
+        split_functions=False,
+    ):
+        with open(fixtures_path) as f:
+            self.fixtures = json.load(f)
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.errors = errors or {}
+        self.limits = limits or {}  # requests per second per upstream
+        # With the functions protocol, make one call per subject over several model calls instead of one call in all
+        self.split_functions = split_functions
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self.throttled = Counter()
+        self._recent = {upstream: deque() for upstream in self.limits}
+        self._lock = threading.Lock()
+        self.server = None
+
+    def start(self, port=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def env(self):
+        """Settings that point newsbot at these stubs."""
+        return {
+            "NEWSBOT_BRAVE_BASE_URL": f"{self.url}/brave/res/v1",
+            "NEWSBOT_NEWSAPI_BASE_URL": f"{self.url}/newsapi/v2",
+            "NEWSBOT_OPENAI_API_BASE": f"{self.url}/openai/v1",
+            "NEWSBOT_OPENAI_API_KEY": "sk-stub",
+            "NEWSBOT_BRAVE_API_KEY": "stub",
+            "NEWSBOT_NEWSAPI_API_KEY": "stub",
+        }
+
+    def delay(self, upstream):
+        """Sleep for the upstream's latency, with +/-50% jitter; return True if an error should be injected."""
+        time.sleep(self.latency.get(upstream, 0) * self.random.uniform(0.5, 1.5))
+        return self.random.random() < self.errors.get(upstream, 0)
+
+    def over_limit(self, upstream):
+        """Count a request against the upstream's limit; True if it should be answered with a 429."""
+        if upstream not in self.limits:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            recent = self._recent[upstream]
+            while recent and now - recent[0] >= 1:
+                recent.popleft()
+            if len(recent) >= self.limits[upstream]:
+                self.throttled[upstream] += 1
+                return True
+            recent.append(now)
+            return False
+
+    def fill(self, value, query):
+        text = json.dumps(value).replace("{article_base}", f"{self.url}/articles")
+        return json.loads(text.replace("{query}", query))
+
+    ### RESPONSES
+
+    def brave(self, path, query):
+        if path.endswith("/news/search"):
+            return self.fill(self.fixtures["brave_news"], query)
+        return self.fill(self.fixtures["brave_web"], query)
+
+    def newsapi(self, path, query):
+        return self.fill(self.fixtures["newsapi"], query)
+
+    def article(self, slug):
+        article = self.fixtures["articles"].get(slug)
+        if article is None:
+            return None
+        paragraphs = "".join(f"<p>{s}.</p>" for s in article["body"].split(". "))
+        return (
+            f"<html><head><title>{article['title']}</title></head><body>"
+            f"<article><h1>{article['title']}</h1>{paragraphs}</article></body></html>"
+        )
+
+    def chat(self, body):
+        """A scripted model: call a search tool for the question, or per subject with tools, then answer from their results."""
+        messages = body["messages"]
+        question = next(
+            (m["content"] for m in reversed(messages) if m["role"] == "user"), ""
+        )
+        tools = [t["function"]["name"] for t in body.get("tools", [])]
+        functions = [f["name"] for f in body.get("functions", [])] or tools
+        done = sum(m["role"] == "function" for m in messages)
+        finished = messages[-1]["role"] == "tool" or (done and not self.split_functions)
+        if finished or not functions:
+            return {"content": self.answer(messages)}
+
+        calls = []
+        split = tools or self.split_functions
+        for part in question.split(" and ") if split else [question]:
+            lowered = part.lower()
+            country = next((c for c in COUNTRY_CODES if c in lowered), None)
+            if lowered.startswith(("who", "what are")) and "answer_search" in functions:
+                calls.append(("answer_search", {"query": part}))
+            elif country and "news in" in lowered and "get_api_headlines" in functions:
+                calls.append(
+                    ("get_api_headlines", {"countrycode": COUNTRY_CODES[country]})
+                )
+            else:
+                calls.append(("news_search", {"query": part}))
+        if tools:
+            return {
+                "tool_calls": [
+                    {
+                        "id": f"call_{i}",
+                        "type": "function",
+                        "function": {"name": name, "arguments": json.dumps(args)},
+                    }
+                    for i, (name, args) in enumerate(calls)
+                ]
+            }
+        # One function call per model call, so each subject takes an iteration of its own
+        if done >= len(calls):
+            return {"content": self.answer(messages)}
+        name, args = calls[done]
+        return {"function_call": {"name": name, "arguments": json.dumps(args)}}
+
+    def answer(self, messages):
+        observations = " ".join(
+            m["content"] or "" for m in messages if m["role"] in ("function", "tool")
+        )
+        if not observations:
+            # A plain completion, e.g. an article or history summary
+            text = messages[-1]["content"].split("\n\n")[-1]
+            return "Summary: " + ". ".join(text.split(". ")[:2])
+        links = list(dict.fromkeys(URL_RE.findall(observations)))[:3]
+        return (
+            "Here is the latest I found. "
+            + ". ".join(observations.split(". ")[:3])[:400]
+            + "\n\nSources:\n"
+            + "\n".join(f"- {link}" for link in links)
+        )
+
+    def _handler(self):
+        stubs = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_error_status(self):
+                self.send_json(503, {"error": "injected failure"})
+
+            def send_throttled(self):
+                data = json.dumps(
+                    {"error": {"message": "rate limit exceeded"}}
+                ).encode()
+                self.send_response(429)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                upstream = parts.path.split("/")[1]
+                stubs.requests[upstream] += 1
+                query = parse_qs(parts.query).get("q", [""])[0]
+                if stubs.over_limit(upstream):
+                    return self.send_throttled()
+                if stubs.delay(upstream):
+                    return self.send_error_status()
+                if upstream == "brave":
+                    return self.send_json(200, stubs.brave(parts.path, query))
+                if upstream == "newsapi":
+                    return self.send_json(200, stubs.newsapi(parts.path, query))
+                if upstream == "articles":
+                    page = stubs.article(parts.path.split("/")[-1])
+                    if page is None:
+                        return self.send_json(404, {"error": "not found"})
+                    etag = '"' + hashlib.sha1(page.encode()).hexdigest() + '"'
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    data = page.encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                self.send_json(404, {"error": "unknown upstream"})
+
+            def do_POST(self):
+                stubs.requests["openai"] += 1
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if stubs.over_limit("openai"):
+                    return self.send_throttled()
+                if stubs.delay("openai"):
+                    return self.send_error_status()
+                message = stubs.chat(body)
+                if body.get("stream"):
+                    return self.stream(body, message)
+                completion = message.get("content") or ""
+                prompt_tokens = len(json.dumps(body["messages"])) // 4
+                completion_tokens = len(completion or json.dumps(message)) // 4
+                finish = (
+                    "tool_calls"
+                    if "tool_calls" in message
+                    else "function_call" if "function_call" in message else "stop"
+                )
+                self.send_json(
+                    200,
+                    {
+                        "id": "chatcmpl-stub",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body["model"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": dict(
+                                    {"role": "assistant", "content": None}, **message
+                                ),
+                                "finish_reason": finish,
+                            }
+                        ],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": completion_tokens,
+                            "total_tokens": prompt_tokens + completion_tokens,
+                        },
+                    },
+                )
+
+            def stream(self, body, message):
+                def chunk(delta, finish=None):
+                    return {
+                        "id": "chatcmpl-stub",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body["model"],
+                        "choices": [
+                            {"index": 0, "delta": delta, "finish_reason": finish}
+                        ],
+                    }
+
+                chunks = [chunk({"role": "assistant", "content": ""})]
+                if "tool_calls" in message:
+                    calls = [
+                        dict(c, index=i) for i, c in enumerate(message["tool_calls"])
+                    ]
+                    chunks += [chunk({"tool_calls": calls}), chunk({}, "tool_calls")]
+                elif "function_call" in message:
+                    chunks += [
+                        chunk({"function_call": message["function_call"]}),
+                        chunk({}, "function_call"),
+                    ]
+                else:
+                    words = re.findall(r"\S+\s*", message["content"])
+                    chunks += [chunk({"content": w}) for w in words]
+                    chunks.append(chunk({}, "stop"))
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for c in chunks:
+                    self.write_chunk(f"data: {json.dumps(c)}\n\n".encode())
+                    time.sleep(TOKEN_DELAY)
+                self.write_chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", help="e.g. brave=0.3,newsapi=0.4,openai=0.8")
+    parser.add_argument("--errors", help="error rate per upstream, e.g. brave=0.05")
+    parser.add_argument("--limits", help="requests per second, e.g. brave=5")
+    parser.add_argument(
+        "--split-functions",
+        action="store_true",
+        help="with the functions protocol, have the stub model call a tool per subject",
+    )
+    args = parser.parse_args()
+
+    stubs = StubUpstreams(
+        latency=parse_pairs(args.latency),
+        errors=parse_pairs(args.errors),
+        limits=parse_pairs(args.limits),
+        split_functions=args.split_functions,
+    )
+    stubs.start(args.port)
+    print(f"Stubs listening on {stubs.url}. Point newsbot at them with:")
+    for name, value in stubs.env().items():
+        print(f"  export {name}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stubs.stop()
+
+
+if __name__ == "__main__":
+    main()
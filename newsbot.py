@@ -1,14 +1,18 @@
 import streamlit as st
 from agent import (
     agent_with_message_history,
+    cached_answer,
+    gen_session_id,
     get_session_history,
-    store,
-    current_session_id,
-    reset_session,
+    remember_answer,
 )
+from utils.metrics import TurnTimings, turn_first_token_seconds, turn_seconds
+from utils.reduce import context_reducer
+from utils.streaming import answer_token, iter_events
 
 # Enable LangSmith tracing
 import os
+import time
 
 os.environ["LANGCHAIN_TRACING_V2"] = st.secrets["langchain_tracing_v2"]
 os.environ["LANGCHAIN_PROJECT"] = st.secrets["langchain_project"]
@@ -21,19 +25,105 @@ st.caption(
     """    Chat with me about the latest news or facts about a country, a personality, a company, an issue or an event!"""
 )
 
-# Initiate/get session history with current session id
-get_session_history(session_id=current_session_id)
-session_limit = 8
 
-# # Display chat messages from history on app rerun
-history = store[current_session_id].messages
-for i in range(len(history)):
-    if i % 2 == 0:
-        with st.chat_message("user"):
-            st.write(f"{history[i].content}")
+def tool_progress(action):
+    """Progress message shown while a tool runs."""
+    if "query" in action.tool_input:
+        return f"Looking for '{action.tool_input['query']}'"
+    elif action.tool == "answer_search":
+        return "👨🏻‍💻👨🏻‍💻 Searching the web..."
+    elif action.tool == "get_news":
+        return "🗞️🗞️ Getting the latest news..."
+    elif action.tool == "country_news_search":
+        return "🌎🌎 Getting country news..."
+    elif action.tool == "webpage_retriever":
+        return "👾👾 Retrieving info..."
     else:
-        with st.chat_message("assistant"):
-            st.write(f"{history[i].content}")
+        return "⌛️⌛️ Just a moment more..."
+
+
+def tool_call_key(action):
+    """Identifies a tool call across the events of a turn; the action objects themselves are copies."""
+    return getattr(action, "tool_call_id", action.log)
+
+
+show_timings = st.sidebar.toggle("Show timings", help="Time every step of each answer")
+
+# Keep the session id in the URL so a reload or restarted server picks the conversation back up
+if "session" not in st.query_params:
+    st.query_params["session"] = gen_session_id()
+current_session_id = st.query_params["session"]
+
+# # Display chat messages from history on app rerun
+history = get_session_history(session_id=current_session_id).all_messages()
+for message in history:
+    with st.chat_message("user" if message.type == "human" else "assistant"):
+        st.write(f"{message.content}")
+
+
+def run_agent(qn, timings):
+    """Run the agent on a question, showing tool progress then streaming its answer; returns the answer and tool steps."""
+    started = time.perf_counter()
+    events = iter_events(
+        agent_with_message_history,
+        {"input": qn},
+        config={
+            "configurable": {"session_id": current_session_id},
+            "callbacks": [timings],
+        },
+    )
+    turn_steps = []
+    root_run_id = None
+    first_token = None
+    answer = ""
+    # One line per tool call of the current step, ticked off as each result comes in
+    in_flight = {}
+
+    # Show tool progress until the model starts writing its answer
+    for event in events:
+        root_run_id = root_run_id or event["run_id"]
+        first_token = answer_token(event)
+        if first_token:
+            break
+        if event["event"] != "on_chain_stream" or event["run_id"] != root_run_id:
+            continue
+        chunk = event["data"]["chunk"]
+        if "actions" in chunk:
+            for action in chunk["actions"]:
+                line = in_flight[tool_call_key(action)] = st.empty()
+                line.write(f"⏳ {tool_progress(action)}")
+        elif "steps" in chunk:
+            for step in chunk["steps"]:
+                turn_steps.append((step.action, step.observation))
+                line = in_flight.pop(tool_call_key(step.action), None)
+                if line is not None:
+                    line.write(f"✅ {tool_progress(step.action)}")
+            if not in_flight:
+                st.write("😽😽 Analysing results...")
+        elif "output" in chunk:
+            answer = chunk["output"]
+            st.write(f"{answer}")
+        else:
+            raise ValueError()
+
+    # Then stream the rest of the answer token by token
+    if first_token:
+        time_to_first_token = time.perf_counter() - started
+        turn_first_token_seconds.observe(time_to_first_token)
+        print(f"Time to first token: {time_to_first_token:.2f}s")
+
+        def answer_tokens():
+            yield first_token
+            for event in events:
+                token = answer_token(event)
+                if token:
+                    yield token
+
+        answer = st.write_stream(answer_tokens())
+
+    # Report how many prompt tokens the context reduction saved this turn
+    print(f"Context reduction: {context_reducer.report(turn_steps)}")
+    return answer, turn_steps
 
 
 if qn := st.chat_input("Ask away!"):
@@ -44,34 +134,28 @@ if qn := st.chat_input("Ask away!"):
 
     # Display assistant response in chat message container
     with st.chat_message("assistant"):
-        stream = agent_with_message_history.stream(
-            {"input": qn},
-            config={"configurable": {"session_id": current_session_id}},
-        )
-        for chunk in stream:
-            if "actions" in chunk:
-                if "query" in chunk["actions"][0].tool_input:
-                    st.write(f"Looking for '{chunk['actions'][0].tool_input['query']}'")
-                elif chunk["actions"][0].tool == "answer_search":
-                    st.write("👨🏻‍💻👨🏻‍💻 Searching the web...")
-                elif chunk["actions"][0].tool == "get_news":
-                    st.write("🗞️🗞️ Getting the latest news...")
-                elif chunk["actions"][0].tool == "country_news_search":
-                    st.write("🌎🌎 Getting country news...")
-                elif chunk["actions"][0].tool == "webpage_retriever":
-                    st.write("👾👾 Retrieving info...")
-                else:
-                    st.write("⌛️⌛️ Just a moment more...")
-            elif "steps" in chunk:
-                st.write("😽😽 Analysing results...")
-            elif "output" in chunk:
-                st.write(f"{chunk['output']}")
-            else:
-                raise ValueError()
-
-    # If session limit is reached, delete current session key-value pair from store and generate new current session id
-    if len(history) >= session_limit:
-        st.warning("Resetting session state", icon="⚠️")
-        reset_session(current_session_id)
+        started = time.perf_counter()
+        timings = TurnTimings()
+
+        # Near-identical questions asked in the last few minutes are answered from the semantic cache
+        context = get_session_history(current_session_id).messages
+        cached = cached_answer(current_session_id, qn, context)
+        if cached:
+            st.write(cached["answer"])
+            minutes = (time.time() - cached["created_at"]) // 60
+            st.caption(f"🗂️ Answered {minutes:.0f} min ago for '{cached['question']}'")
+        else:
+            answer, turn_steps = run_agent(qn, timings)
+            remember_answer(qn, answer, turn_steps, context)
+
+        turn_time = time.perf_counter() - started
+        turn_seconds.observe(turn_time)
+        if show_timings:
+            with st.expander(f"⏱️ {turn_time:.2f}s"):
+                st.dataframe(timings.rows, use_container_width=True)
+                st.caption(
+                    f"{timings.tokens['prompt']} prompt tokens, "
+                    f"{timings.tokens['completion']} completion tokens"
+                )
 
 print(len(history), current_session_id)
@@ -0,0 +1,82 @@
+# Labelled questions the intent router in utils/router.py is trained on, one tool per question, or "none" when
+# the model should answer without one.
+# The held-out set used to measure routing accuracy is benchmarks/routing_queries.json.
+routing_examples = [
+    # news_search
+    ("What is the latest news about tiktok?", "news_search"),
+    ("Harrison Chase", "news_search"),
+    ("latest on the boeing investigation", "news_search"),
+    ("any news on the openai board", "news_search"),
+    ("what happened with nvidia today", "news_search"),
+    ("Elon Musk", "news_search"),
+    ("updates on the gaza ceasefire talks", "news_search"),
+    ("breaking news about the earthquake", "news_search"),
+    ("give me the latest headlines on apple", "news_search"),
+    ("what's new with the writers strike", "news_search"),
+    ("Sam Altman news", "news_search"),
+    ("recent news about climate summit", "news_search"),
+    ("whats going on with twitter", "news_search"),
+    ("news on bitcoin etf", "news_search"),
+    ("Tesla recall", "news_search"),
+    ("latest tiktok ban update", "news_search"),
+    ("tell me the latest about the super bowl", "news_search"),
+    ("what is happening with the ukraine war", "news_search"),
+    ("Donald Trump trial", "news_search"),
+    ("any updates on the strike at ford", "news_search"),
+    # answer_search
+    ("Who is Harrison Chase", "answer_search"),
+    ("What are some popular tiktok songs?", "answer_search"),
+    ("taylor swift and singapore", "answer_search"),
+    ("who founded langchain", "answer_search"),
+    ("what is a large language model", "answer_search"),
+    ("how does the electoral college work", "answer_search"),
+    ("when was the eiffel tower built", "answer_search"),
+    ("what is the capital of australia", "answer_search"),
+    ("how many people live in tokyo", "answer_search"),
+    ("who won the world cup in 2018", "answer_search"),
+    ("why is the sky blue", "answer_search"),
+    ("what does the federal reserve do", "answer_search"),
+    ("where is the headquarters of tiktok", "answer_search"),
+    ("who is the ceo of microsoft", "answer_search"),
+    ("explain how interest rates affect inflation", "answer_search"),
+    ("what are the best selling albums of all time", "answer_search"),
+    ("messi and inter miami", "answer_search"),
+    ("how old is joe biden", "answer_search"),
+    ("what is bytedance", "answer_search"),
+    ("define quantitative easing", "answer_search"),
+    # get_api_headlines
+    ("What's the news in Singapore?", "get_api_headlines"),
+    ("headlines in japan", "get_api_headlines"),
+    ("latest news from india", "get_api_headlines"),
+    ("what is happening in malaysia today", "get_api_headlines"),
+    ("uk headlines", "get_api_headlines"),
+    ("top stories in australia", "get_api_headlines"),
+    ("news from the united states", "get_api_headlines"),
+    ("what's going on in germany", "get_api_headlines"),
+    ("france news today", "get_api_headlines"),
+    ("give me the top headlines for canada", "get_api_headlines"),
+    # multi_search
+    ("What is happening with the Fed and interest rates?", "multi_search"),
+    ("latest on the election and the economy", "multi_search"),
+    ("everything about the tiktok ban from all sources", "multi_search"),
+    ("compare coverage of the budget across outlets", "multi_search"),
+    ("news on ai regulation in the eu and the us", "multi_search"),
+    ("what are different outlets saying about the strike", "multi_search"),
+    ("broad roundup of tech news this week", "multi_search"),
+    ("all the latest on oil prices and opec", "multi_search"),
+    # none: small talk and requests the model answers without a tool
+    ("hello", "none"),
+    ("hi there", "none"),
+    ("thanks!", "none"),
+    ("thank you so much", "none"),
+    ("ok", "none"),
+    ("cool, bye", "none"),
+    ("tell me a joke", "none"),
+    ("translate this to french", "none"),
+    ("write me a poem", "none"),
+    ("good morning", "none"),
+    ("can you help me", "none"),
+    ("make it shorter", "none"),
+    ("say that in spanish", "none"),
+    ("sounds good", "none"),
+]
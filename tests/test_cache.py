@@ -0,0 +1,16 @@
+from utils.cache import SharedResults, ToolCache, make_key
+
+
+def test_results_loaded_from_the_shared_store_are_evicted_like_any_other(tmp_path):
+    shared = SharedResults(tmp_path / "tool_cache.db")
+    writer = ToolCache(shared=shared)
+    for n in range(5):
+        writer.put("news_search", make_key("news_search", {"query": n}), f"result {n}")
+
+    reader = ToolCache(max_entries=2, shared=shared)
+    for n in range(5):
+        assert reader.peek("news_search", {"query": n}) == f"result {n}"
+
+    stats = reader.stats()
+    assert stats["size"] == 2
+    assert stats["tools"]["news_search"]["evictions"] == 3
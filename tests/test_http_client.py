@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from utils import http_client as http
+from utils.ratelimit import RateLimiter, RateLimitExceeded, TokenBuckets
+
+
+def half_open(breaker):
+    breaker.failures = breaker.failure_threshold
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout
+    assert breaker.state == "half-open"
+
+
+def test_rate_limit_wait_does_not_use_up_half_open_trial(tmp_path, monkeypatch):
+    limiter = RateLimiter({"brave": (1, 3600)}, TokenBuckets(tmp_path / "rl.db"))
+    monkeypatch.setattr(http, "rate_limiter", limiter)
+    client = http.HttpClient()
+    breaker = client.breaker("brave")
+    half_open(breaker)
+    # Empty the bucket: the next request would have to wait an hour
+    limiter.acquire("brave")
+
+    with pytest.raises(RateLimitExceeded):
+        client.get("http://brave.invalid/", upstream="brave")
+
+    assert not breaker._trial_running
+    assert breaker.allow()
+
+
+def test_other_request_errors_settle_half_open_trial(monkeypatch):
+    client = http.HttpClient()
+    breaker = client.breaker("example.com")
+    half_open(breaker)
+
+    def redirect_loop(*args, **kwargs):
+        raise http.requests.TooManyRedirects("Exceeded 30 redirects.")
+
+    monkeypatch.setattr(client.pages, "request", redirect_loop)
+    with pytest.raises(http.requests.TooManyRedirects):
+        client.get("https://example.com/article")
+
+    assert not breaker._trial_running
+    assert breaker.state == "open"
+    breaker.opened_at -= breaker.reset_timeout
+    assert breaker.allow()
+
+
+def test_deadline_covers_a_body_that_trickles_in(monkeypatch):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import threading
+
+    class Trickle(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "100")
+            self.end_headers()
+            for _ in range(100):
+                self.wfile.write(b"x")
+                self.wfile.flush()
+                time.sleep(0.05)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Trickle)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = http.HttpClient(timeout=(1, 1))
+    monkeypatch.setattr(client, "_backoff_delay", lambda *args: 0.0)
+    started = time.monotonic()
+    try:
+        with pytest.raises(http.requests.Timeout):
+            client.get(
+                f"http://127.0.0.1:{server.server_port}/",
+                deadline=time.monotonic() + 0.5,
+            )
+    finally:
+        server.shutdown()
+    assert time.monotonic() - started < 1.5
+
+
+def test_article_pages_have_their_own_connection_pools():
+    client = http.HttpClient()
+    api = client.session.get_adapter("https://api.search.brave.com/")
+    pages = client.pages.get_adapter("https://example.com/")
+    assert api is not pages
+    for n in range(http.PAGE_POOL_CONNECTIONS):
+        pages.get_connection(f"https://site{n}.example.com/")
+    assert len(api.poolmanager.pools) == 0
@@ -0,0 +1,33 @@
+import socket
+
+from utils.metrics import start_metrics_server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_each_process_gets_its_own_port():
+    port = free_port()
+    first = start_metrics_server(port, host="127.0.0.1")
+    second = start_metrics_server(port, host="127.0.0.1")
+    try:
+        assert first.server_port == port
+        assert second is not None and second.server_port > port
+    finally:
+        for server in (first, second):
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+
+def test_gives_up_when_every_port_is_taken():
+    port = free_port()
+    taken = start_metrics_server(port, host="127.0.0.1", tries=1)
+    try:
+        assert start_metrics_server(port, host="127.0.0.1", tries=1) is None
+    finally:
+        taken.shutdown()
+        taken.server_close()
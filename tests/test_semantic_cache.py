@@ -0,0 +1,54 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils.semantic_cache import SemanticCache, names_subject
+
+
+def chat(*turns):
+    return [
+        cls(content=text)
+        for turn in turns
+        for cls, text in zip((HumanMessage, AIMessage), turn)
+    ]
+
+
+def test_follow_ups_without_a_subject_are_never_shared():
+    cache = SemanticCache()
+    history = chat(
+        ("Is my landlord allowed to evict me?", "Here is what the law says...")
+    )
+    for question in ("What did I just ask you?", "Why?", "How so?", "How many died?"):
+        assert not names_subject(question)
+        cache.add(
+            question,
+            f"You asked about your landlord. ({question})",
+            "answer_search",
+            history,
+        )
+
+    other_chat = chat(("Hi", "Hello! What news are you after?"))
+    assert cache.lookup("what did i just ask you", "answer_search", other_chat) is None
+    assert cache.lookup("What did I just ask you?", "answer_search", history) is None
+    assert cache.stats()["stores"] == 0
+
+
+def test_questions_naming_a_subject_mid_chat_only_match_the_same_conversation():
+    cache = SemanticCache()
+    history = chat(("Latest news about Nvidia", "Nvidia reported..."))
+    cache.add("Who is Jensen Huang?", "The CEO of Nvidia.", "answer_search", history)
+
+    assert cache.lookup("who is jensen huang", "answer_search", history) is not None
+    assert (
+        cache.lookup("who is jensen huang", "answer_search", chat(("Hi", "Hello!")))
+        is None
+    )
+    assert cache.lookup("who is jensen huang", "answer_search") is None
+
+
+def test_first_questions_are_shared_across_sessions():
+    cache = SemanticCache()
+    cache.add("Who is Jensen Huang?", "The CEO of Nvidia.", "answer_search")
+
+    assert (
+        cache.lookup("who is jensen huang", "answer_search")["answer"]
+        == "The CEO of Nvidia."
+    )
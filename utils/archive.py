@@ -0,0 +1,226 @@
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+from utils.article_store import DATA_DIR, canonical_url
+from utils.config import setting
+from utils.db import ThreadConnections
+from utils.metrics import archive_search_seconds
+from utils.semantic_cache import FILLER
+
+### ARCHIVE SETTINGS
+
+RETENTION_DAYS = int(setting("archive_retention_days", "90"))
+PRUNE_EVERY = 1000  # writes between deletions of stories past retention
+MAX_TERMS = 12
+# bm25 weight of each indexed column: a match in the title counts most
+COLUMN_WEIGHTS = (4.0, 2.0, 1.0)
+EXCERPT_TOKENS = 48  # words of body text returned around the matches
+
+TERM_RE = re.compile(r"\w+", re.UNICODE)
+TAG_RE = re.compile(r"<[^>]+>")
+
+# Stories live in `stories`; `stories_fts` indexes them without keeping a second copy of the text, and the
+# triggers keep the two in step
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL DEFAULT '',
+    snippet TEXT NOT NULL DEFAULT '',
+    body TEXT NOT NULL DEFAULT '',
+    source TEXT,
+    published REAL,
+    archived_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stories_archived ON stories (archived_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5(
+    title, snippet, body, content='stories', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS stories_ai AFTER INSERT ON stories BEGIN
+    INSERT INTO stories_fts(rowid, title, snippet, body)
+    VALUES (new.id, new.title, new.snippet, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS stories_ad AFTER DELETE ON stories BEGIN
+    INSERT INTO stories_fts(stories_fts, rowid, title, snippet, body)
+    VALUES ('delete', old.id, old.title, old.snippet, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS stories_au AFTER UPDATE OF title, snippet, body ON stories BEGIN
+    INSERT INTO stories_fts(stories_fts, rowid, title, snippet, body)
+    VALUES ('delete', old.id, old.title, old.snippet, old.body);
+    INSERT INTO stories_fts(rowid, title, snippet, body)
+    VALUES (new.id, new.title, new.snippet, new.body);
+END;
+"""
+
+# A story seen again keeps its longest text and earliest publish time
+UPSERT = """
+INSERT INTO stories (url, title, snippet, body, source, published, archived_at)
+VALUES (:url, :title, :snippet, :body, :source, :published, :archived_at)
+ON CONFLICT (url) DO UPDATE SET
+    title = CASE WHEN excluded.title != '' THEN excluded.title ELSE title END,
+    snippet = CASE WHEN length(excluded.snippet) > length(snippet)
+        THEN excluded.snippet ELSE snippet END,
+    body = CASE WHEN length(excluded.body) > length(body) THEN excluded.body ELSE body END,
+    source = COALESCE(source, excluded.source),
+    published = COALESCE(published, excluded.published),
+    archived_at = excluded.archived_at
+"""
+
+SEARCH = """
+SELECT s.url, s.title, s.snippet, s.source, s.published, s.archived_at,
+    snippet(stories_fts, 2, '', '', '...', {excerpt}) AS excerpt
+FROM stories_fts JOIN stories s ON s.id = stories_fts.rowid
+WHERE stories_fts MATCH :match AND COALESCE(s.published, s.archived_at) >= :since
+ORDER BY bm25(stories_fts, {weights})
+LIMIT :limit
+"""
+
+
+def timestamp(value):
+    """Epoch seconds of a datetime or ISO 8601 string, or None."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def match_expression(query):
+    """An FTS5 query that matches any of the query's content words, each quoted so none is read as syntax."""
+    terms = [t for t in TERM_RE.findall(query.lower()) if t not in FILLER]
+    terms = list(dict.fromkeys(terms))[:MAX_TERMS]
+    return " OR ".join(f'"{t}"' for t in terms)
+
+
+def iso(seconds):
+    if seconds is None:
+        return None
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat(timespec="seconds")
+
+
+class Archive:
+    """Full-text index of every story the tools have seen: search results, and the text of pages read.
+
+    SQLite FTS5 ranks matches by bm25 on disk, so lookups stay in the milliseconds with millions of stories,
+    and worker processes on the host share one file.
+    """
+
+    def __init__(self, path=None, retention_days=RETENTION_DAYS):
+        self.path = path or os.path.join(DATA_DIR, "archive.db")
+        self.retention = retention_days * 86400
+        self._connections = ThreadConnections(self.path, row_factory=sqlite3.Row)
+        self._writes = 0
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return self._connections.get()
+
+    def add(self, stories):
+        """Archive dicts with a url and any of title, snippet, body, source and published."""
+        now = time.time()
+        rows = [
+            {
+                "url": canonical_url(story["url"]),
+                "title": story.get("title") or "",
+                "snippet": TAG_RE.sub("", story.get("snippet") or ""),
+                "body": story.get("body") or "",
+                "source": story.get("source"),
+                "published": timestamp(story.get("published")),
+                "archived_at": now,
+            }
+            for story in stories
+            if story.get("url")
+        ]
+        if not rows:
+            return
+        try:
+            with self._connect() as conn:
+                conn.executemany(UPSERT, rows)
+        except sqlite3.Error as e:
+            # Losing a few stories from the archive must never fail the search that found them
+            print(f"Error archiving {len(rows)} stories, exception: {e}")
+            return
+        self._writes += len(rows)
+        if self._writes >= PRUNE_EVERY:
+            self._writes = 0
+            self.prune()
+
+    def add_results(self, results, source):
+        """Archive a search tool's results: result dicts or Documents."""
+        if not isinstance(results, list):
+            return
+        stories = []
+        for result in results:
+            if isinstance(result, dict):
+                stories.append(
+                    {
+                        "url": result.get("url"),
+                        "title": result.get("title"),
+                        "snippet": result.get("description"),
+                        "published": result.get("published"),
+                        "source": source,
+                    }
+                )
+            else:
+                stories.append(
+                    {
+                        "url": result.metadata.get("link"),
+                        "title": result.metadata.get("title"),
+                        "snippet": result.page_content,
+                        "source": source,
+                    }
+                )
+        self.add(stories)
+
+    def search(self, query, max_age_hours=None, limit=5):
+        """Best bm25 matches published (or, with no publish time, archived) in the last `max_age_hours`."""
+        match = match_expression(query)
+        if not match:
+            return []
+        since = time.time() - max_age_hours * 3600 if max_age_hours else 0
+        sql = SEARCH.format(
+            excerpt=EXCERPT_TOKENS, weights=", ".join(map(str, COLUMN_WEIGHTS))
+        )
+        started = time.perf_counter()
+        rows = (
+            self._connect()
+            .execute(sql, {"match": match, "since": since, "limit": limit})
+            .fetchall()
+        )
+        archive_search_seconds.observe(time.perf_counter() - started)
+        stories = []
+        for row in rows:
+            story = {
+                "title": row["title"],
+                "url": row["url"],
+                "description": row["snippet"],
+                "published": iso(row["published"]),
+                "source": row["source"],
+            }
+            # Pages that were read also give the passage around the matches
+            if row["excerpt"]:
+                story["excerpt"] = row["excerpt"]
+            stories.append(story)
+        return stories
+
+    def prune(self):
+        """Delete stories archived longer ago than the retention period."""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM stories WHERE archived_at < ?",
+                (time.time() - self.retention,),
+            )
+
+
+archive = Archive()
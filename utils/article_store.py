@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from utils.config import setting
+from utils.db import ThreadConnections
+
+### ARTICLE STORE SETTINGS
+
+DATA_DIR = setting("data_dir", ".newsbot")
+MAX_BYTES = 200 * 1024 * 1024
+EVICT_EVERY = 50  # writes between size checks
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ocid", "cmpid"}
+
+
+def canonical_url(url):
+    """Lower-case the host, drop fragments, default ports and tracking params, and sort the query."""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in TRACKING_PARAMS
+    )
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    content_hash TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (content_hash, prompt_hash)
+);
+CREATE INDEX IF NOT EXISTS articles_accessed ON articles (accessed_at);
+CREATE INDEX IF NOT EXISTS summaries_accessed ON summaries (accessed_at);
+"""
+
+
+class ArticleStore:
+    """On-disk store of extracted articles and their summaries, keyed by canonical URL.
+
+    Backed by SQLite in WAL mode so several worker processes can share one file.
+    """
+
+    def __init__(self, path=None, max_bytes=MAX_BYTES):
+        self.path = path or os.path.join(DATA_DIR, "articles.db")
+        self.max_bytes = max_bytes
+        self._connections = ThreadConnections(self.path, row_factory=sqlite3.Row)
+        self._writes = 0
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return self._connections.get()
+
+    def get_article(self, url):
+        """Return the stored article for `url` as a dict, or None."""
+        key = canonical_url(url)
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM articles WHERE url = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE articles SET accessed_at = ? WHERE url = ?", (time.time(), key)
+            )
+        article = dict(row)
+        article["metadata"] = json.loads(article["metadata"])
+        return article
+
+    def put_article(self, url, text, metadata, etag=None, last_modified=None):
+        now = time.time()
+        metadata_json = json.dumps(metadata, default=str)
+        size = len(text.encode("utf-8")) + len(metadata_json)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    canonical_url(url),
+                    etag,
+                    last_modified,
+                    content_hash(text),
+                    text,
+                    metadata_json,
+                    size,
+                    now,
+                    now,
+                ),
+            )
+        self._written()
+
+    def revalidated(self, url):
+        """Record that the stored copy of `url` was confirmed unchanged."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE articles SET fetched_at = ? WHERE url = ?",
+                (time.time(), canonical_url(url)),
+            )
+
+    def get_summary(self, text_hash, prompt_hash):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT summary FROM summaries WHERE content_hash = ? AND prompt_hash = ?",
+            (text_hash, prompt_hash),
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE summaries SET accessed_at = ? WHERE content_hash = ? AND prompt_hash = ?",
+                (time.time(), text_hash, prompt_hash),
+            )
+        return row["summary"]
+
+    def put_summary(self, text_hash, prompt_hash, summary):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?)",
+                (
+                    text_hash,
+                    prompt_hash,
+                    summary,
+                    len(summary.encode("utf-8")),
+                    time.time(),
+                ),
+            )
+        self._written()
+
+    def _written(self):
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def size(self):
+        conn = self._connect()
+        articles = conn.execute("SELECT COALESCE(SUM(size), 0) FROM articles")
+        summaries = conn.execute("SELECT COALESCE(SUM(size), 0) FROM summaries")
+        return articles.fetchone()[0] + summaries.fetchone()[0]
+
+    def evict(self):
+        """Delete least recently used articles and summaries until the store fits in `max_bytes`."""
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            excess = self.size() - self.max_bytes
+            if excess <= 0:
+                return
+            rows = conn.execute("""
+                SELECT 'articles' AS tbl, url AS key, '' AS prompt, size, accessed_at FROM articles
+                UNION ALL
+                SELECT 'summaries', content_hash, prompt_hash, size, accessed_at FROM summaries
+                ORDER BY accessed_at
+                """)
+            for row in rows.fetchall():
+                if excess <= 0:
+                    break
+                if row["tbl"] == "articles":
+                    conn.execute("DELETE FROM articles WHERE url = ?", (row["key"],))
+                else:
+                    conn.execute(
+                        "DELETE FROM summaries WHERE content_hash = ? AND prompt_hash = ?",
+                        (row["key"], row["prompt"]),
+                    )
+                excess -= row["size"]
+
+
+article_store = ArticleStore()
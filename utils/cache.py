@@ -0,0 +1,383 @@
+import contextvars
+import inspect
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import wraps
+
+from utils.article_store import DATA_DIR
+from utils.db import ThreadConnections
+
+### CACHE SETTINGS
+
+# Per tool: (seconds a result is fresh, extra seconds it may be served stale while it refreshes)
+TOOL_TTLS = {
+    "get_api_headlines": (300, 300),
+    "top_headlines_search": (300, 300),
+    "get_api_news": (600, 600),
+    "news_search": (600, 600),
+    "answer_search": (3600, 3600),
+}
+DEFAULT_TTL = (600, 600)
+MAX_ENTRIES = 1000
+CALL_LOG_RETENTION = 24 * 3600  # seconds of tool calls kept to find the frequent ones
+
+
+def make_key(tool_name, params):
+    """Normalise query params so that 'TikTok ' and 'tiktok' share a cache entry."""
+    normalised = []
+    for name, value in sorted(params.items()):
+        if isinstance(value, str):
+            value = " ".join(value.lower().split())
+        elif isinstance(value, (list, tuple)):
+            value = tuple(value)
+        normalised.append((name, value))
+    return (tool_name, tuple(normalised))
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS calls (
+    tool TEXT NOT NULL,
+    params TEXT NOT NULL,
+    called_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calls_called ON calls (called_at);
+"""
+
+
+class SharedResults:
+    """SQLite copy of tool results and a log of tool calls, shared by every process on the host.
+
+    It lets a standalone prefetch worker warm the cache of the app processes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DATA_DIR, "tool_cache.db")
+        self._connections = ThreadConnections(self.path)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(results)")]
+            if "expires_at" not in columns:
+                # Files written before rows kept their own expiry: theirs count as expired
+                conn.execute(
+                    "ALTER TABLE results ADD COLUMN expires_at REAL NOT NULL DEFAULT 0"
+                )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS results_expires ON results (expires_at)"
+            )
+
+    def _connect(self):
+        return self._connections.get()
+
+    def get(self, key):
+        """(value, age in seconds) of the stored result, or None."""
+        row = (
+            self._connect()
+            .execute("SELECT value, stored_at FROM results WHERE key = ?", (repr(key),))
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return pickle.loads(row[0]), time.time() - row[1]
+
+    def put(self, key, value, max_age):
+        """Store a result that may be served for `max_age` seconds, and drop every row past its own expiry."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, stored_at, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (repr(key), pickle.dumps(value), now, now + max_age),
+            )
+            conn.execute("DELETE FROM results WHERE expires_at < ?", (now,))
+
+    def log_call(self, tool_name, params):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO calls VALUES (?, ?, ?)",
+                (tool_name, json.dumps(params, sort_keys=True, default=str), now),
+            )
+            conn.execute(
+                "DELETE FROM calls WHERE called_at < ?", (now - CALL_LOG_RETENTION,)
+            )
+
+    def frequent_calls(self, since, limit):
+        """[(tool, params, count)] of the most frequent tool calls since the `since` timestamp."""
+        rows = self._connect().execute(
+            """
+            SELECT tool, params, COUNT(*) AS n FROM calls WHERE called_at > ?
+            GROUP BY tool, params ORDER BY n DESC LIMIT ?
+            """,
+            (since, limit),
+        )
+        return [(tool, json.loads(params), n) for tool, params, n in rows.fetchall()]
+
+
+class _Entry:
+    __slots__ = ("value", "stored_at", "ttl", "stale_ttl")
+
+    def __init__(self, value, ttl, stale_ttl, age=0.0):
+        self.value = value
+        self.stored_at = time.monotonic() - age
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+    def age(self):
+        return time.monotonic() - self.stored_at
+
+
+class ToolCache:
+    """Process-wide LRU cache of tool results with per-tool TTLs and stale-while-revalidate.
+
+    Concurrent misses on the same key are coalesced so that only one upstream call is made. With a `shared`
+    store, misses are looked up there before calling the upstream, and fetched results are written to it.
+    """
+
+    def __init__(
+        self, ttls=None, default_ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES, shared=None
+    ):
+        self.ttls = dict(TOOL_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._refresher = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="cache-refresh"
+        )
+
+    def _count(self, tool_name, counter):
+        counters = self._counters.setdefault(
+            tool_name,
+            {
+                "hits": 0,
+                "stale_hits": 0,
+                "shared_hits": 0,
+                "misses": 0,
+                "refreshes": 0,
+                "evictions": 0,
+            },
+        )
+        counters[counter] += 1
+
+    def get_or_fetch(self, tool_name, params, fetch):
+        """Return the cached result for this tool call, calling `fetch()` on a miss."""
+        key = make_key(tool_name, params)
+        if self.shared is not None:
+            self._log_call(tool_name, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = entry.age()
+                if age <= entry.ttl:
+                    self._entries.move_to_end(key)
+                    self._count(tool_name, "hits")
+                    return entry.value
+                if age <= entry.ttl + entry.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self._count(tool_name, "stale_hits")
+                    if key not in self._inflight:
+                        self._inflight[key] = Future()
+                        self._count(tool_name, "refreshes")
+                        self._refresher.submit(
+                            contextvars.copy_context().run,
+                            self._refresh,
+                            tool_name,
+                            key,
+                            fetch,
+                        )
+                    return entry.value
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self._count(tool_name, "misses")
+
+        if not owner:
+            return future.result()
+        entry = self._load_shared(tool_name, key)
+        if entry is None:
+            with self._lock:
+                self._count(tool_name, "misses")
+            return self._refresh(tool_name, key, fetch)
+        with self._lock:
+            self._count(tool_name, "shared_hits")
+            self._inflight.pop(key, None)
+        future.set_result(entry.value)
+        if entry.age() > entry.ttl:
+            self.warm(tool_name, params, fetch)
+        return entry.value
+
+    def _log_call(self, tool_name, params):
+        try:
+            self.shared.log_call(tool_name, params)
+        except sqlite3.Error as e:
+            print(f"Error logging call to {tool_name}, exception: {e}")
+
+    def _load_shared(self, tool_name, key):
+        """Copy a result another process stored into memory, keeping its age; None if there is none usable."""
+        if self.shared is None:
+            return None
+        try:
+            stored = self.shared.get(key)
+        except (sqlite3.Error, pickle.UnpicklingError) as e:
+            print(f"Error reading shared result for {tool_name}, exception: {e}")
+            return None
+        ttl, stale_ttl = self.ttls.get(tool_name, self.default_ttl)
+        if stored is None or stored[1] > ttl + stale_ttl:
+            return None
+        entry = _Entry(stored[0], ttl, stale_ttl, age=stored[1])
+        self._store(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        """Add an entry as the most recently used one, evicting the least recently used past max_entries."""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._count(evicted_key[0], "evictions")
+
+    def _lookup(self, tool_name, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry if entry is not None else self._load_shared(tool_name, key)
+
+    def peek(self, tool_name, params):
+        """The cached result of a tool call, fresh or stale, without counting a lookup; None if there is none."""
+        entry = self._lookup(tool_name, make_key(tool_name, params))
+        return None if entry is None else entry.value
+
+    def fresh_for(self, tool_name, params):
+        """Seconds until the cached result of a tool call goes stale; 0 if there is none or it already has."""
+        entry = self._lookup(tool_name, make_key(tool_name, params))
+        return 0 if entry is None else max(entry.ttl - entry.age(), 0)
+
+    def warm(self, tool_name, params, fetch, min_remaining=0):
+        """Fetch a result in the background unless it stays fresh for `min_remaining` more seconds.
+
+        Returns the future of the fetch, or None if nothing needed fetching.
+        """
+        key = make_key(tool_name, params)
+        entry = self._lookup(tool_name, key)
+        with self._lock:
+            if entry is not None and entry.ttl - entry.age() > min_remaining:
+                return None
+            if key in self._inflight:
+                return self._inflight[key]
+            future = self._inflight[key] = Future()
+            self._count(tool_name, "refreshes")
+        # In a copy of the caller's context, so the fetch keeps its rate limit priority
+        self._refresher.submit(
+            contextvars.copy_context().run,
+            self._refresh,
+            tool_name,
+            key,
+            fetch,
+        )
+        return future
+
+    def _refresh(self, tool_name, key, fetch):
+        with self._lock:
+            future = self._inflight[key]
+        try:
+            value = fetch()
+        except BaseException as e:
+            # Failures are never cached; a stale entry, if any, stays in place.
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        self.put(tool_name, key, value)
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def put(self, tool_name, key, value):
+        ttl, stale_ttl = self.ttls.get(tool_name, self.default_ttl)
+        if self.shared is not None:
+            try:
+                self.shared.put(key, value, max_age=ttl + stale_ttl)
+            except (sqlite3.Error, pickle.PicklingError) as e:
+                print(f"Error sharing result for {tool_name}, exception: {e}")
+        self._store(key, _Entry(value, ttl, stale_ttl))
+
+    def invalidate(self, tool_name=None):
+        with self._lock:
+            if tool_name is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == tool_name]:
+                    del self._entries[key]
+
+    def stats(self):
+        """Hit/miss counters per tool, plus overall size and hit rate."""
+        with self._lock:
+            per_tool = {name: dict(c) for name, c in self._counters.items()}
+            size = len(self._entries)
+        hits = sum(
+            c["hits"] + c["stale_hits"] + c["shared_hits"] for c in per_tool.values()
+        )
+        lookups = hits + sum(c["misses"] for c in per_tool.values())
+        return {
+            "size": size,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "tools": per_tool,
+        }
+
+
+tool_cache = ToolCache(shared=SharedResults())
+# Fetch functions wrapped by `cached`, by tool name, so that the prefetcher can refresh them
+cached_functions = {}
+
+
+def cached(tool_name, cache=tool_cache):
+    """Decorator caching a fetch function's result under `tool_name` and its call arguments.
+
+    The decorated function should raise on failure so that errors are never cached.
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def arguments(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return dict(bound.arguments)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return cache.get_or_fetch(
+                tool_name, arguments(args, kwargs), lambda: func(*args, **kwargs)
+            )
+
+        def warm(*args, min_remaining=0, **kwargs):
+            return cache.warm(
+                tool_name,
+                arguments(args, kwargs),
+                lambda: func(*args, **kwargs),
+                min_remaining,
+            )
+
+        wrapper.warm = warm
+        cached_functions[tool_name] = wrapper
+        return wrapper
+
+    return decorator
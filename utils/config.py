@@ -0,0 +1,19 @@
+import os
+
+import streamlit as st
+
+
+def setting(name, default=None):
+    """Look up a setting in the NEWSBOT_<NAME> environment variable, then in st.secrets.
+
+    The environment wins, so headless runs and benchmarks can point the tools at other endpoints without a secrets file.
+    """
+    value = os.environ.get(f"NEWSBOT_{name.upper()}")
+    if value is not None:
+        return value
+    try:
+        return st.secrets[name]
+    except (KeyError, FileNotFoundError):
+        if default is None:
+            raise KeyError(f"Missing setting {name!r} in environment or st.secrets")
+        return default
@@ -0,0 +1,28 @@
+import os
+import sqlite3
+import threading
+
+
+class ThreadConnections:
+    """One connection per thread to a SQLite file shared by every process on the host.
+
+    WAL lets readers carry on while another process writes, and synchronous=NORMAL only syncs at checkpoints.
+    """
+
+    def __init__(self, path, row_factory=None, **kwargs):
+        self.path = path
+        self.row_factory = row_factory
+        self.kwargs = dict(timeout=30, **kwargs)  # for sqlite3.connect
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, **self.kwargs)
+            if self.row_factory is not None:
+                conn.row_factory = self.row_factory
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
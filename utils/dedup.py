@@ -0,0 +1,158 @@
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
+
+from utils.article_store import canonical_url
+
+### DEDUP SETTINGS
+
+NUM_PERM = 64
+TITLE_THRESHOLD = 0.5  # estimated Jaccard of title/description shingles
+BODY_THRESHOLD = 0.6  # estimated Jaccard of article body shingles
+MAX_ALIASES = 5000
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(42)
+PERMUTATIONS = [
+    (_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME))
+    for _ in range(NUM_PERM)
+]
+
+
+def shingles(text, k=3):
+    words = WORD_RE.findall((text or "").lower())
+    if len(words) < k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i : i + k]) for i in range(len(words) - k + 1)}
+
+
+def minhash(text, k=3):
+    """MinHash signature of the text's word k-shingles."""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+        for s in shingles(text, k)
+    ]
+    if not hashes:
+        return None
+    return tuple(
+        min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS
+    )
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    if sig_a is None or sig_b is None:
+        return 0.0
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / NUM_PERM
+
+
+def cluster(signatures, threshold, confirm=None):
+    """Group near-duplicate items, returning lists of indexes in rank order.
+
+    `confirm(i, j)`, if given, must also hold for two items to be merged.
+    """
+    parent = list(range(len(signatures)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(signatures)):
+        for j in range(i + 1, len(signatures)):
+            if find(i) == find(j):
+                continue
+            if similarity(signatures[i], signatures[j]) < threshold:
+                continue
+            if confirm is not None and not confirm(i, j):
+                continue
+            parent[find(j)] = find(i)
+
+    groups = OrderedDict()
+    for i in range(len(signatures)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+class AliasRegistry:
+    """Remembers which URLs were confirmed, on their body text, to carry another story, so they aren't fetched again."""
+
+    def __init__(self, max_size=MAX_ALIASES):
+        self.max_size = max_size
+        self._aliases = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, representative, alternates):
+        with self._lock:
+            for url in alternates:
+                self._aliases[canonical_url(url)] = representative
+                self._aliases.move_to_end(canonical_url(url))
+            while len(self._aliases) > self.max_size:
+                self._aliases.popitem(last=False)
+
+    def resolve(self, url):
+        with self._lock:
+            return self._aliases.get(canonical_url(url), url)
+
+
+aliases = AliasRegistry()
+
+
+def dedupe_results(results, threshold=TITLE_THRESHOLD):
+    """Collapse syndicated copies of the same story in a list of search results.
+
+    Each result is a dict with "title", "url" and optionally "description". The highest ranked copy is kept,
+    with the other copies' URLs listed under "alternate_sources".
+    """
+    if not isinstance(results, list):
+        return results
+    signatures = [
+        minhash(f"{r.get('title', '')} {r.get('description', '')}") for r in results
+    ]
+    deduped = []
+    for group in cluster(signatures, threshold):
+        representative = dict(results[group[0]])
+        alternates = [results[i]["url"] for i in group[1:]]
+        if alternates:
+            # Not registered as aliases: titles alone may match different stories, so the pages are still read
+            representative["alternate_sources"] = alternates
+        deduped.append(representative)
+    return deduped
+
+
+class DocumentClusterer:
+    """Clusters extracted articles as they arrive: a title match must be confirmed on body text.
+
+    The first article of each cluster is its representative; later copies are recorded as its alternates.
+    """
+
+    def __init__(self, threshold=TITLE_THRESHOLD, body_threshold=BODY_THRESHOLD):
+        self.threshold = threshold
+        self.body_threshold = body_threshold
+        self.clusters = []  # [title signature, body signature, link, alternate links]
+
+    def add(self, doc):
+        """Returns True if `doc` is a new story, False if it joined an existing cluster."""
+        title = minhash(doc.metadata.get("title") or "", k=2)
+        body = minhash(doc.page_content)
+        link = doc.metadata.get("link")
+        for cluster_title, cluster_body, representative, alternates in self.clusters:
+            if (
+                similarity(title, cluster_title) >= self.threshold
+                and similarity(body, cluster_body) >= self.body_threshold
+            ):
+                alternates.append(link)
+                aliases.add(representative, [link])
+                return False
+        self.clusters.append([title, body, link, []])
+        return True
+
+    def alternates(self, link):
+        for _, _, representative, alternates in self.clusters:
+            if representative == link:
+                return alternates
+        return []
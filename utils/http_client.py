@@ -0,0 +1,274 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from utils.metrics import http_request_seconds
+from utils.ratelimit import MAX_THROTTLED, rate_limiter
+
+### HTTP CLIENT SETTINGS
+
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+MAX_RETRIES = 2
+BACKOFF = 0.5  # seconds, doubled on every retry before jitter
+MAX_RETRY_AFTER = 30  # don't sleep longer than this on a Retry-After header
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+POOL_CONNECTIONS = 10  # number of API hosts with a pool
+POOL_MAXSIZE = 20  # keep-alive connections per API host
+PAGE_POOL_CONNECTIONS = 50  # number of article sites with a pool
+PAGE_POOL_MAXSIZE = 4  # keep-alive connections per article site
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+CHUNK_SIZE = 65536  # bytes read at a time from a body due by a deadline
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Fails fast after `failure_threshold` consecutive failures, then lets one trial request through after `reset_timeout` seconds."""
+
+    def __init__(
+        self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+def retry_after_seconds(response):
+    """Parse a Retry-After header given either in seconds or as an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def bounded_timeout(timeout, left):
+    """A requests timeout, (connect, read) or a single value, cut down to the `left` seconds before a deadline."""
+    if left is None:
+        return timeout
+    if isinstance(timeout, tuple):
+        return tuple(min(t, left) for t in timeout)
+    return min(timeout, left)
+
+
+class HttpClient:
+    """Shared HTTP client with pooled keep-alive connections, deadlines, retries and a circuit breaker per upstream."""
+
+    def __init__(
+        self,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        max_retries=MAX_RETRIES,
+        backoff=BACKOFF,
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # Article pages come from many sites: in a pool of their own they can't push the API upstreams' keep-alive
+        # connections out of it
+        self.session = self._new_session(POOL_CONNECTIONS, POOL_MAXSIZE)
+        self.pages = self._new_session(PAGE_POOL_CONNECTIONS, PAGE_POOL_MAXSIZE)
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _new_session(self, pool_connections, pool_maxsize):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        return session
+
+    def breaker(self, upstream):
+        with self._lock:
+            if upstream not in self._breakers:
+                self._breakers[upstream] = CircuitBreaker()
+            return self._breakers[upstream]
+
+    def _backoff_delay(self, attempt, response=None):
+        delay = random.uniform(0, self.backoff * 2**attempt)
+        if response is not None:
+            retry_after = retry_after_seconds(response)
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, self.backoff)
+        return delay
+
+    def _time_left(self, deadline, url):
+        """Seconds until the deadline, or None without one; raises requests.Timeout once it has passed."""
+        if deadline is None:
+            return None
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise requests.Timeout(f"{url} did not load before its deadline")
+        return left
+
+    def _too_late(self, deadline, delay):
+        """Whether waiting `delay` seconds before a retry would reach the deadline."""
+        return deadline is not None and time.monotonic() + delay >= deadline
+
+    def _read_body(self, response, deadline):
+        """Read a streamed response's body, giving up at the deadline even if the server keeps trickling bytes.
+
+        read1 returns whatever has arrived instead of waiting for a whole chunk, so the deadline is checked often.
+        """
+        read = getattr(response.raw, "read1", None) or response.raw.read
+        chunks = []
+        try:
+            while True:
+                chunk = read(CHUNK_SIZE, decode_content=True)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                if time.monotonic() > deadline:
+                    response.close()
+                    raise requests.Timeout(
+                        f"{response.url} did not load before its deadline"
+                    )
+        # The same errors requests raises when it reads a body itself
+        except urllib3.exceptions.ReadTimeoutError as e:
+            raise requests.Timeout(e)
+        except urllib3.exceptions.DecodeError as e:
+            raise requests.exceptions.ContentDecodingError(e)
+        except urllib3.exceptions.HTTPError as e:
+            raise requests.exceptions.ChunkedEncodingError(e)
+        response._content = b"".join(chunks)
+        response._content_consumed = True
+
+    def request(self, method, url, upstream=None, deadline=None, **kwargs):
+        """Send a request, retrying 429/5xx responses and connection errors with jittered backoff.
+
+        Requests to rate-limited upstreams wait for their turn first, and a 429 holds back every request to that
+        upstream for as long as it asks, without using up a retry.
+        With a `deadline` (a time.monotonic() value), the whole call, retries and body included, raises
+        requests.Timeout once it passes; a response that can't be retried in time is returned as is.
+        The last response is returned as is once retries run out, so callers should still check its status.
+        """
+        # Article pages from any site are timed together, so the metric labels stay few
+        label = upstream or "web"
+        session = self.session if upstream else self.pages
+        upstream = upstream or urlsplit(url).netloc
+        breaker = self.breaker(upstream)
+        timeout = kwargs.pop("timeout", self.timeout)
+        if deadline is not None:
+            kwargs["stream"] = True
+
+        attempt = throttled = 0
+        while True:
+            left = self._time_left(deadline, url)
+            # Waiting for the rate limit first means a half-open breaker's trial can't be lost to it
+            rate_limiter.acquire(upstream)
+            if not breaker.allow():
+                raise CircuitOpenError(f"{upstream} is unavailable, try again later")
+            last_attempt = attempt == self.max_retries
+            started = time.perf_counter()
+            try:
+                response = session.request(
+                    method, url, timeout=bounded_timeout(timeout, left), **kwargs
+                )
+                if deadline is not None:
+                    self._read_body(response, deadline)
+            except (requests.ConnectionError, requests.Timeout):
+                http_request_seconds.observe(
+                    time.perf_counter() - started, upstream=label, status="error"
+                )
+                breaker.record_failure()
+                delay = self._backoff_delay(attempt)
+                if last_attempt or self._too_late(deadline, delay):
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except requests.RequestException:
+                # Redirect loops and broken bodies aren't worth retrying, but must still settle a breaker's trial
+                http_request_seconds.observe(
+                    time.perf_counter() - started, upstream=label, status="error"
+                )
+                breaker.record_failure()
+                raise
+
+            http_request_seconds.observe(
+                time.perf_counter() - started,
+                upstream=label,
+                status=response.status_code,
+            )
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if response.status_code == 429 and throttled < MAX_THROTTLED:
+                throttled += 1
+                delay = self._backoff_delay(throttled, response)
+                if delay <= MAX_RETRY_AFTER and not self._too_late(deadline, delay):
+                    rate_limiter.throttled(upstream, delay)
+                    response.close()
+                    # Unless the upstream is rate limited here, the next acquire won't wait
+                    if upstream not in rate_limiter.limits:
+                        time.sleep(delay)
+                    continue
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                return response
+            delay = self._backoff_delay(attempt, response)
+            if delay > MAX_RETRY_AFTER or self._too_late(deadline, delay):
+                return response
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, params=None, headers=None, upstream=None, **kwargs):
+        return self.request(
+            "GET", url, upstream=upstream, params=params, headers=headers, **kwargs
+        )
+
+
+http_client = HttpClient()
@@ -0,0 +1,184 @@
+import json
+import os
+import time
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import (
+    SystemMessage,
+    message_to_dict,
+    messages_from_dict,
+)
+
+from utils.article_store import DATA_DIR
+from utils.config import setting
+from utils.db import ThreadConnections
+from utils.reduce import count_tokens
+
+### MEMORY SETTINGS
+
+HISTORY_BACKEND = setting("history_backend", "sqlite")
+HISTORY_TOKEN_BUDGET = 1500  # recent messages sent verbatim with every turn
+SUMMARY_PROMPT = """Progressively summarise the conversation between a user and a news assistant, adding onto the previous summary. Keep the names, topics and url links that were discussed.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL DEFAULT '',
+    summarised_upto INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def summarise_messages(model, summary, messages):
+    """Fold `messages` into the rolling `summary` with the given chat model."""
+    lines = "\n".join(f"{m.type}: {m.content}" for m in messages)
+    prompt = SUMMARY_PROMPT.format(summary=summary or "(none)", lines=lines)
+    return model.invoke(prompt).content
+
+
+class HistoryStore:
+    """SQLite store of chat messages for every session, shared by all worker processes."""
+
+    def __init__(self, path=None, summarise=None, token_budget=HISTORY_TOKEN_BUDGET):
+        self.path = path or os.path.join(DATA_DIR, "history.db")
+        self.summarise = summarise
+        self.token_budget = token_budget
+        self._connections = ThreadConnections(self.path)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return self._connections.get()
+
+    def history(self, session_id):
+        return SQLiteChatMessageHistory(self, session_id)
+
+    def session(self, session_id):
+        row = (
+            self._connect()
+            .execute(
+                "SELECT summary, summarised_upto FROM sessions WHERE session_id = ?",
+                (session_id,),
+            )
+            .fetchone()
+        )
+        return row or ("", 0)
+
+    def load(self, session_id, after=0):
+        """(id, message, tokens) rows for the session, oldest first."""
+        rows = self._connect().execute(
+            "SELECT id, message, tokens FROM messages WHERE session_id = ? AND id > ? ORDER BY id",
+            (session_id, after),
+        )
+        return [
+            (id, messages_from_dict([json.loads(message)])[0], tokens)
+            for id, message, tokens in rows.fetchall()
+        ]
+
+    def append(self, session_id, message):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO messages (session_id, message, tokens, created_at) VALUES (?, ?, ?, ?)",
+                (
+                    session_id,
+                    json.dumps(message_to_dict(message)),
+                    count_tokens(message.content),
+                    time.time(),
+                ),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, updated_at) VALUES (?, ?)",
+                (session_id, time.time()),
+            )
+
+    def compact(self, session_id):
+        """Fold the oldest messages into the rolling summary once the window is over budget.
+
+        The window is cut down to half the budget, so that summarisation runs every few turns rather than every turn.
+        """
+        summary, summarised_upto = self.session(session_id)
+        rows = self.load(session_id, after=summarised_upto)
+        total = sum(tokens for _, _, tokens in rows)
+        if total <= self.token_budget:
+            return
+
+        folded = []
+        while rows and total > self.token_budget // 2:
+            id, message, tokens = rows.pop(0)
+            folded.append(message)
+            total -= tokens
+            summarised_upto = id
+        if self.summarise is not None:
+            try:
+                summary = self.summarise(summary, folded)
+            except Exception as e:
+                # Keep the messages in the window: they are retried at the next compaction rather than lost
+                print(f"Error summarising session {session_id}, exception: {e}")
+                return
+
+        # Another process may have compacted the session in the meantime; keep whichever ran first
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE sessions SET summary = ?, summarised_upto = ?, updated_at = ? WHERE session_id = ? AND summarised_upto < ?",
+                (summary, summarised_upto, time.time(), session_id, summarised_upto),
+            )
+
+    def clear(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """Chat history of one session: a rolling summary of older turns plus a token-budgeted window of recent ones."""
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+
+    @property
+    def messages(self):
+        summary, summarised_upto = self.store.session(self.session_id)
+        window = [m for _, m, _ in self.store.load(self.session_id, summarised_upto)]
+        if summary:
+            window.insert(
+                0,
+                SystemMessage(content=f"Summary of the conversation so far: {summary}"),
+            )
+        return window
+
+    def all_messages(self):
+        """Every message of the session, for display."""
+        return [m for _, m, _ in self.store.load(self.session_id)]
+
+    def add_message(self, message):
+        self.store.append(self.session_id, message)
+        self.store.compact(self.session_id)
+
+    def clear(self):
+        self.store.clear(self.session_id)
+
+
+# Other backends only need to provide HistoryStore's session/load/append/compact/clear methods
+HISTORY_BACKENDS = {"sqlite": HistoryStore}
+
+
+def make_history_store(backend=HISTORY_BACKEND, **kwargs):
+    return HISTORY_BACKENDS[backend](**kwargs)
@@ -0,0 +1,437 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.reduce import count_tokens
+
+### METRICS SETTINGS
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+AGENT_EXECUTOR_TAG = "agent_executor"
+# Worker processes on a host each take the first free port from metrics_port on
+PORT_RANGE = 16
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [
+        (name, str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in pairs
+    ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metric:
+    """A metric family with one value per combination of label values."""
+
+    type = "unknown"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Read at scrape time instead, for values that are already counted elsewhere
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def values(self):
+        if self.collect is not None:
+            return self.collect()
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+    def render(self):
+        lines = [f"# TYPE {self.name} {self.type}", f"# HELP {self.name} {self.help}"]
+        for key, value in sorted(self.values().items()):
+            lines.extend(self.samples(key, value))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self, key, value):
+        yield f"{self.name}_total{format_labels(self.labels, key)} {value}"
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self, key, value):
+        yield f"{self.name}{format_labels(self.labels, key)} {value}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # One count per bucket plus one for values above the last bound, and the sum
+            counts = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def _copy(self, value):
+        return list(value)
+
+    def samples(self, key, value):
+        count = 0
+        for bound, bucket in zip(self.buckets + ("+Inf",), value[:-1]):
+            count += bucket
+            labels = format_labels(self.labels, key, [("le", bound)])
+            yield f"{self.name}_bucket{labels} {count}"
+        yield f"{self.name}_sum{format_labels(self.labels, key)} {value[-1]}"
+        yield f"{self.name}_count{format_labels(self.labels, key)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=(), collect=None):
+        return self.register(Counter(name, help, labels, collect))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """Every metric in the OpenMetrics text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [line for metric in metrics for line in metric.render()]
+        return "\n".join(lines + ["# EOF"]) + "\n"
+
+
+registry = Registry()
+
+### NEWSBOT METRICS
+
+turn_seconds = registry.histogram(
+    "newsbot_turn_seconds", "Wall time of a chat turn, from question to full answer."
+)
+turn_first_token_seconds = registry.histogram(
+    "newsbot_turn_first_token_seconds",
+    "Time from question to the first streamed token of the answer.",
+)
+agent_iteration_seconds = registry.histogram(
+    "newsbot_agent_iteration_seconds",
+    "Wall time of one agent iteration: planning plus the tool calls it asked for.",
+)
+llm_call_seconds = registry.histogram(
+    "newsbot_llm_call_seconds", "Wall time of LLM calls.", ["model"]
+)
+llm_first_token_seconds = registry.histogram(
+    "newsbot_llm_first_token_seconds",
+    "Time to the first streamed token of LLM calls.",
+    ["model"],
+)
+llm_tokens = registry.counter(
+    "newsbot_llm_tokens",
+    "LLM tokens, by kind (prompt or completion).",
+    ["model", "kind"],
+)
+tool_call_seconds = registry.histogram(
+    "newsbot_tool_call_seconds", "Wall time of tool calls.", ["tool", "status"]
+)
+http_request_seconds = registry.histogram(
+    "newsbot_http_request_seconds",
+    "Wall time of upstream HTTP requests, per attempt.",
+    ["upstream", "status"],
+)
+
+
+semantic_cache_lookup_seconds = registry.histogram(
+    "newsbot_semantic_cache_lookup_seconds",
+    "Time to embed a question and search the semantic answer cache.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+)
+archive_search_seconds = registry.histogram(
+    "newsbot_archive_search_seconds",
+    "Time to search the local story archive.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+
+def cache_lookups():
+    from utils.cache import tool_cache
+
+    return {
+        (tool, result): count
+        for tool, counters in tool_cache.stats()["tools"].items()
+        for result, count in counters.items()
+    }
+
+
+def cache_hit_rate():
+    from utils.cache import tool_cache
+
+    return {(): tool_cache.stats()["hit_rate"]}
+
+
+registry.counter(
+    "newsbot_cache_events",
+    "Tool cache hits, stale hits, misses, refreshes and evictions since start.",
+    ["tool", "event"],
+    collect=cache_lookups,
+)
+registry.gauge(
+    "newsbot_cache_hit_rate",
+    "Share of tool cache lookups served from cache.",
+    [],
+    cache_hit_rate,
+)
+
+
+def semantic_cache_events():
+    from utils.semantic_cache import semantic_cache
+
+    stats = semantic_cache.stats()
+    return {(event,): stats[event] for event in ("hits", "misses", "skipped", "stores")}
+
+
+def semantic_cache_size():
+    from utils.semantic_cache import semantic_cache
+
+    return {(): semantic_cache.stats()["size"]}
+
+
+registry.counter(
+    "newsbot_semantic_cache_events",
+    "Semantic answer cache hits, misses, skipped follow-up questions and stored answers.",
+    ["event"],
+    collect=semantic_cache_events,
+)
+registry.gauge(
+    "newsbot_semantic_cache_entries",
+    "Live answers in the semantic cache.",
+    collect=semantic_cache_size,
+)
+
+
+### CALLBACKS
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Times agent iterations, LLM calls and tool calls of every run it is attached to."""
+
+    # Timestamps must be taken when the event happens, not when a worker thread gets to it
+    run_inline = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executors = {}  # executor run id -> start of its current iteration
+        self._llm_runs = {}  # run id -> [model, started, first token, prompt tokens]
+        self._tool_runs = {}  # run id -> (tool, started)
+
+    def observe(self, kind, name, seconds, **labels):
+        """Record one timing; `kind` is iteration, llm, first_token or tool."""
+        if kind == "iteration":
+            agent_iteration_seconds.observe(seconds)
+        elif kind == "llm":
+            llm_call_seconds.observe(seconds, model=name)
+        elif kind == "first_token":
+            llm_first_token_seconds.observe(seconds, model=name)
+        elif kind == "tool":
+            tool_call_seconds.observe(seconds, tool=name, **labels)
+
+    def count_tokens(self, model, prompt, completion):
+        llm_tokens.inc(prompt, model=model, kind="prompt")
+        llm_tokens.inc(completion, model=model, kind="completion")
+
+    # Agent iterations: each one starts with the executor asking the agent to plan
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs
+    ):
+        now = time.perf_counter()
+        with self._lock:
+            if AGENT_EXECUTOR_TAG in (kwargs.get("tags") or []):
+                self._executors[run_id] = None
+                return
+            if parent_run_id not in self._executors:
+                return
+            started = self._executors[parent_run_id]
+            self._executors[parent_run_id] = now
+        if started is not None:
+            self.observe("iteration", None, now - started)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            if run_id not in self._executors:
+                return
+            started = self._executors.pop(run_id)
+        if started is not None:
+            self.observe("iteration", None, time.perf_counter() - started)
+
+    on_chain_error = on_chain_end
+
+    # LLM calls
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or "unknown"
+        prompt = sum(count_tokens(str(m.content)) for m in messages[0])
+        with self._lock:
+            self._llm_runs[run_id] = [model, time.perf_counter(), None, prompt]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._llm_runs.get(run_id)
+            if run is None or run[2] is not None:
+                return
+            run[2] = time.perf_counter()
+        self.observe("first_token", run[0], run[2] - run[1])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            run = self._llm_runs.pop(run_id, None)
+        if run is None:
+            return
+        model, started, _, prompt = run
+        self.observe("llm", model, time.perf_counter() - started)
+        # Streamed completions carry no usage, so count those tokens ourselves
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            self.count_tokens(
+                model, usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+            )
+        else:
+            generation = response.generations[0][0]
+            completion = generation.text
+            message = getattr(generation, "message", None)
+            if message is not None and message.additional_kwargs:
+                # Function and tool calls
+                completion += str(message.additional_kwargs)
+            self.count_tokens(model, prompt, count_tokens(completion))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            run = self._llm_runs.pop(run_id, None)
+        if run is not None:
+            self.observe("llm", run[0], time.perf_counter() - run[1])
+
+    # Tool calls
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        with self._lock:
+            self._tool_runs[run_id] = (serialized.get("name"), time.perf_counter())
+
+    def _end_tool(self, run_id, status):
+        with self._lock:
+            tool, started = self._tool_runs.pop(run_id, (None, None))
+        if tool is not None:
+            self.observe("tool", tool, time.perf_counter() - started, status=status)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        # The tools catch their own exceptions and return an error message instead
+        status = "error" if str(output).startswith("An error has occurred") else "ok"
+        self._end_tool(run_id, status)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end_tool(run_id, "error")
+
+
+class TurnTimings(MetricsCallbackHandler):
+    """Collects the timings of a single turn as rows, for display, instead of exporting them."""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.tokens = {"prompt": 0, "completion": 0}
+
+    def observe(self, kind, name, seconds, **labels):
+        step = {
+            "iteration": "Agent iteration",
+            "llm": f"LLM call ({name})",
+            "first_token": f"LLM first token ({name})",
+            "tool": f"Tool {name}",
+        }[kind]
+        if labels.get("status") == "error":
+            step += " (failed)"
+        with self._lock:
+            self.rows.append({"step": step, "seconds": round(seconds, 3)})
+
+    def count_tokens(self, model, prompt, completion):
+        with self._lock:
+            self.tokens["prompt"] += prompt
+            self.tokens["completion"] += completion
+
+
+metrics_handler = MetricsCallbackHandler()
+
+
+### SCRAPE ENDPOINT
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        data = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port, host="0.0.0.0", tries=PORT_RANGE):
+    """Serve /metrics on a daemon thread, on the first free port of `port` to `port + tries - 1`.
+
+    Metrics are kept per process, so every worker process on a host serves its own; scrape the whole range.
+    Returns the server, or None if every port is taken.
+    """
+    for candidate in range(port, port + tries):
+        try:
+            server = ThreadingHTTPServer((host, candidate), MetricsRequestHandler)
+            break
+        except OSError:
+            continue
+    else:
+        print(
+            f"Metrics endpoint not started: ports {port} to {port + tries - 1} are all taken"
+        )
+        return None
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, daemon=True, name="metrics-server"
+    ).start()
+    print(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
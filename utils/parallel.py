@@ -0,0 +1,82 @@
+import asyncio
+import contextvars
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from langchain.agents import AgentExecutor
+
+from utils.config import setting
+
+### PARALLEL TOOLS SETTINGS
+
+TOOL_WORKERS = int(setting("tool_workers", "4"))  # tool calls of one step run at once
+POOL_SIZE = 32  # threads shared by the tool calls of every agent run in the process
+
+_pool = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="tool")
+# One limit per agent run, keyed by its run manager, so that concurrent runs (batch jobs, sessions) don't
+# share a single TOOL_WORKERS between them
+_limits = weakref.WeakKeyDictionary()
+_limits_lock = threading.Lock()
+
+
+def _limit(run_manager, factory):
+    if run_manager is None:
+        return factory(TOOL_WORKERS)
+    with _limits_lock:
+        if run_manager not in _limits:
+            _limits[run_manager] = factory(TOOL_WORKERS)
+        return _limits[run_manager]
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """An AgentExecutor that runs all the tool calls the model asks for in one step at the same time.
+
+    The stock executor runs them one after another when called synchronously, and all at once, unbounded,
+    when called asynchronously. Both are bounded here by TOOL_WORKERS per agent run.
+    """
+
+    def _perform_agent_action(
+        self, name_to_tool_map, color_mapping, agent_action, run_manager=None
+    ):
+        # Called by `_iter_next_step` once per action; submitting instead of running lets the next one start
+        limit = _limit(run_manager, threading.BoundedSemaphore)
+        limit.acquire()
+        context = contextvars.copy_context()
+        future = _pool.submit(
+            context.run,
+            super()._perform_agent_action,
+            name_to_tool_map,
+            color_mapping,
+            agent_action,
+            run_manager,
+        )
+        future.add_done_callback(lambda _: limit.release())
+        return future
+
+    def _iter_next_step(
+        self,
+        name_to_tool_map,
+        color_mapping,
+        inputs,
+        intermediate_steps,
+        run_manager=None,
+    ):
+        pending = []
+        for chunk in super()._iter_next_step(
+            name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager
+        ):
+            if isinstance(chunk, Future):
+                pending.append(chunk)
+            else:
+                yield chunk
+        for future in pending:
+            yield future.result()
+
+    async def _aperform_agent_action(
+        self, name_to_tool_map, color_mapping, agent_action, run_manager=None
+    ):
+        async with _limit(run_manager, asyncio.Semaphore):
+            return await super()._aperform_agent_action(
+                name_to_tool_map, color_mapping, agent_action, run_manager
+            )
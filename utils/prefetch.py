@@ -0,0 +1,210 @@
+"""Keep predictable tool results warm: country headlines, the most frequent recent tool calls, and the articles
+they link to, extracted and summarised ahead of time.
+
+Runs as a thread inside the app (the default, see the `prefetch` setting), or as a standalone worker that shares
+the cache with the app processes through the data directory:
+
+    python -m utils.prefetch
+    python -m utils.prefetch --once --countries sg,my
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import wait
+
+from utils.article_store import article_store, content_hash
+from utils.cache import TOOL_TTLS, cached_functions, tool_cache
+from utils.config import setting
+from utils.http_client import http_client
+from utils.metrics import registry
+from utils.ratelimit import PREFETCH, priority, rate_limiter
+from utils.resources import chat_model
+from utils.tools import SUMMARY_PROMPT_HASH, load_article, summarise_article
+
+### PREFETCH SETTINGS
+
+PREFETCH_MODE = setting("prefetch", "app")  # app, worker or off
+PREFETCH_COUNTRIES = setting("prefetch_countries", "sg,us,gb,in,au").split(",")
+PREFETCH_INTERVAL = 120  # seconds between rounds
+TOP_CALLS = 10  # most frequent recent tool calls to keep warm
+CALL_WINDOW = 3 * 3600  # seconds of tool calls counted
+ARTICLES_PER_RESULT = 3  # top links of each warmed result to extract and summarise
+SUMMARIES_PER_ROUND = 20  # cap on LLM calls per round
+ROUND_TIMEOUT = 60
+# Requests per hour the prefetcher may spend on each upstream, so that users keep most of the quota
+UPSTREAM_QUOTAS = {
+    name: int(limit)
+    for name, limit in (
+        pair.split("=")
+        for pair in setting("prefetch_quotas", "newsapi=40,brave=300").split(",")
+    )
+}
+TOOL_UPSTREAMS = {
+    "get_api_headlines": "newsapi",
+    "get_api_news": "newsapi",
+    "top_headlines_search": "newsapi",
+    "news_search": "brave",
+    "answer_search": "brave",
+}
+
+prefetches = registry.counter(
+    "newsbot_prefetch",
+    "Prefetched tool calls by outcome: refreshed, fresh, over_quota or circuit_open.",
+    ["tool", "outcome"],
+)
+prefetched_articles = registry.counter(
+    "newsbot_prefetch_articles",
+    "Articles extracted and summarised ahead of time, by outcome.",
+    ["outcome"],
+)
+
+
+class Quota:
+    """Requests per hour the prefetcher may send to each upstream, shared by every prefetching process on the host."""
+
+    def __init__(self, limits=UPSTREAM_QUOTAS, window=3600):
+        self.limits = limits
+        self.window = window
+
+    def take(self, upstream):
+        """Use one request of the upstream's quota; False if there is none left."""
+        if upstream not in self.limits:
+            return True
+        wait = rate_limiter.buckets.take(
+            f"prefetch:{upstream}", self.limits[upstream], self.window
+        )
+        return wait == 0
+
+
+def result_links(result):
+    """Links of a cached tool result: a list of result dicts or Documents."""
+    if not isinstance(result, list):
+        return []
+    links = []
+    for item in result:
+        if isinstance(item, dict):
+            links.append(item.get("url"))
+        else:
+            links.append(item.metadata.get("link"))
+    return [link for link in links if link]
+
+
+class Prefetcher:
+    """Refreshes the planned tool calls shortly before their cached results go stale."""
+
+    def __init__(self, countries=PREFETCH_COUNTRIES, interval=PREFETCH_INTERVAL):
+        self.countries = [c.strip().lower() for c in countries if c.strip()]
+        self.interval = interval
+        self.quota = Quota()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def planned_calls(self):
+        """(tool, params) to keep warm: country headlines first, then the most frequent recent calls."""
+        calls = [("get_api_headlines", {"countrycode": c}) for c in self.countries]
+        if tool_cache.shared is not None:
+            since = time.time() - CALL_WINDOW
+            for tool, params, _ in tool_cache.shared.frequent_calls(since, TOP_CALLS):
+                if tool in cached_functions and (tool, params) not in calls:
+                    calls.append((tool, params))
+        return calls
+
+    def warm(self, tool, params):
+        """Start refreshing a tool call that would go stale before the next round; returns the fetch's future or None."""
+        fresh, _ = TOOL_TTLS.get(tool, (0, 0))
+        min_remaining = min(self.interval + 30, fresh // 2)
+        if tool_cache.fresh_for(tool, params) > min_remaining:
+            prefetches.inc(tool=tool, outcome="fresh")
+            return None
+        upstream = TOOL_UPSTREAMS.get(tool)
+        if upstream and http_client.breaker(upstream).state == "open":
+            prefetches.inc(tool=tool, outcome="circuit_open")
+            return None
+        if not self.quota.take(upstream):
+            prefetches.inc(tool=tool, outcome="over_quota")
+            return None
+        prefetches.inc(tool=tool, outcome="refreshed")
+        return cached_functions[tool].warm(**params, min_remaining=min_remaining)
+
+    def prepare_article(self, model, url, may_summarise):
+        """Extract an article into the store, and summarise it if allowed; returns whether the model was called."""
+        doc = load_article(url)
+        if article_store.get_summary(
+            content_hash(doc.page_content), SUMMARY_PROMPT_HASH
+        ):
+            prefetched_articles.inc(outcome="already_summarised")
+            return False
+        if not may_summarise:
+            prefetched_articles.inc(outcome="extracted")
+            return False
+        summarise_article(model, doc)
+        prefetched_articles.inc(outcome="summarised")
+        return True
+
+    def run_once(self):
+        calls = self.planned_calls()
+        futures = [f for f in (self.warm(tool, params) for tool, params in calls) if f]
+        wait(futures, timeout=ROUND_TIMEOUT)
+
+        # Then read the articles those results link to, so webpage_retriever finds them ready
+        links = []
+        for tool, params in calls:
+            result = tool_cache.peek(tool, params)
+            for link in result_links(result)[:ARTICLES_PER_RESULT]:
+                if link not in links:
+                    links.append(link)
+        model = chat_model()
+        summaries = 0
+        # One at a time, so a round never takes more than one LLM call away from users
+        for link in links:
+            try:
+                called = self.prepare_article(
+                    model, link, summaries < SUMMARIES_PER_ROUND
+                )
+            except Exception as e:
+                prefetched_articles.inc(outcome="failed")
+                print(f"Error prefetching {link}, exception: {e}")
+                continue
+            summaries += called
+        print(
+            f"Prefetched {len(futures)} of {len(calls)} tool calls, "
+            f"{len(links)} articles, {summaries} new summaries"
+        )
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                # Behind users and batch jobs for every upstream, and within the prefetch quotas
+                with priority(PREFETCH):
+                    self.run_once()
+            except Exception as e:
+                print(f"Error in prefetch round, exception: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True, name="prefetch")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep newsbot's hot topics warm.")
+    parser.add_argument("--once", action="store_true", help="run a single round")
+    parser.add_argument("--interval", type=int, default=PREFETCH_INTERVAL)
+    parser.add_argument("--countries", default=",".join(PREFETCH_COUNTRIES))
+    args = parser.parse_args()
+
+    prefetcher = Prefetcher(args.countries.split(","), args.interval)
+    if args.once:
+        with priority(PREFETCH):
+            prefetcher.run_once()
+    else:
+        prefetcher.run()
+
+
+if __name__ == "__main__":
+    main()
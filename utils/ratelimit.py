@@ -0,0 +1,300 @@
+"""Shared rate limits for the upstream APIs: a token bucket per upstream, and one for OpenAI's tokens per minute.
+
+Bucket levels live in SQLite in the data directory, so every session, batch job and prefetch worker on the host
+draws on the same quota. Requests over the limit wait in a priority queue instead of failing: interactive turns
+first, then batch jobs, then prefetching, which also leave part of each bucket for interactive turns so that
+the priorities hold across processes too.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import openai
+from langchain_openai import ChatOpenAI
+
+from utils.article_store import DATA_DIR
+from utils.config import setting
+from utils.db import ThreadConnections
+from utils.metrics import registry
+from utils.reduce import count_tokens
+
+### RATE LIMIT SETTINGS
+
+INTERACTIVE, BATCH, PREFETCH = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch", PREFETCH: "prefetch"}
+# Share of each bucket a request of this priority must leave for the ones above it
+RESERVES = {INTERACTIVE: 0.0, BATCH: 0.2, PREFETCH: 0.4}
+# Longest a request waits for its turn before giving up
+MAX_WAITS = {INTERACTIVE: 30, BATCH: 600, PREFETCH: 60}
+POLL = 0.25  # seconds between checks of a bucket while waiting at the head of the queue
+MAX_THROTTLED = 5  # 429 responses retried per request, on top of the ordinary retries
+COMPLETION_ESTIMATE = 300  # tokens charged for a completion whose length is not capped
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_limits(text):
+    """{"brave": (20, 1), ...} from "brave=20/s,newsapi=250/h": requests (or tokens) per period in seconds."""
+    limits = {}
+    for pair in text.split(","):
+        if not pair.strip():
+            continue
+        name, limit = pair.split("=")
+        count, _, period = limit.partition("/")
+        limits[name.strip()] = (float(count), PERIODS[period.strip() or "s"])
+    return limits
+
+
+RATE_LIMITS = parse_limits(
+    setting(
+        "rate_limits",
+        "brave=20/s,newsapi=250/h,openai=3500/m,openai_tokens=60000/m",
+    )
+)
+
+request_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+rate_limit_wait_seconds = registry.histogram(
+    "newsbot_ratelimit_wait_seconds",
+    "Time requests waited for their upstream's rate limit.",
+    ["upstream", "priority"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+throttled_responses = registry.counter(
+    "newsbot_ratelimit_throttled",
+    "429 responses from upstreams, each retried after the wait it asked for.",
+    ["upstream"],
+)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request would have to wait longer than its priority allows."""
+
+
+@contextlib.contextmanager
+def priority(level):
+    """Run the requests made in this block, and in the threads and tasks it starts, at this priority."""
+    token = request_priority.set(level)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+
+class TokenBuckets:
+    """Token buckets shared by all processes using the same SQLite file."""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DATA_DIR, "ratelimit.db")
+        self._connections = ThreadConnections(self.path, isolation_level=None)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    blocked_until REAL NOT NULL DEFAULT 0
+                )
+                """)
+
+    def _connect(self):
+        return self._connections.get()
+
+    def take(self, name, capacity, period, cost=1, reserve=0.0):
+        """Take `cost` tokens if that leaves `reserve` of the bucket; returns 0, or the seconds to wait first."""
+        rate = capacity / period
+        cost = min(cost, capacity * (1 - reserve))
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at, blocked_until FROM buckets WHERE name = ?",
+                (name,),
+            ).fetchone()
+            tokens, updated_at, blocked_until = row or (capacity, now, 0)
+            tokens = min(capacity, tokens + max(now - updated_at, 0) * rate)
+            if now < blocked_until:
+                wait = blocked_until - now
+            elif tokens - cost >= capacity * reserve:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost + capacity * reserve - tokens) / rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)",
+                (name, tokens, now, blocked_until),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def block(self, name, seconds):
+        """Let nothing through for `seconds`, e.g. after the upstream answered 429."""
+        until = time.time() + seconds
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE buckets SET blocked_until = MAX(blocked_until, ?) WHERE name = ?",
+                (until, name),
+            )
+
+
+class RateLimiter:
+    """Queues requests for each rate-limited upstream by priority, and lets them through as its bucket allows."""
+
+    def __init__(self, limits=RATE_LIMITS, buckets=None):
+        self.limits = limits
+        self.buckets = buckets or TokenBuckets()
+        self._queues = {name: [] for name in limits}
+        self._order = itertools.count()
+        self._changed = threading.Condition()
+
+    def acquire(self, upstream, cost=1, level=None):
+        """Block until the upstream's limit allows a request costing `cost`; returns the seconds waited."""
+        if upstream not in self.limits:
+            return 0.0
+        level = request_priority.get() if level is None else level
+        capacity, period = self.limits[upstream]
+        queue = self._queues[upstream]
+        waiter = (level, next(self._order))
+        started = time.monotonic()
+        with self._changed:
+            heapq.heappush(queue, waiter)
+        try:
+            while True:
+                with self._changed:
+                    while queue[0] != waiter:
+                        self._changed.wait(POLL)
+                wait = self.buckets.take(
+                    upstream, capacity, period, cost, RESERVES[level]
+                )
+                if not wait:
+                    break
+                waited = time.monotonic() - started
+                if waited + wait > MAX_WAITS[level]:
+                    raise RateLimitExceeded(
+                        f"{upstream} is over its rate limit, try again in {wait:.0f}s"
+                    )
+                time.sleep(min(wait, POLL))
+        finally:
+            with self._changed:
+                queue.remove(waiter)
+                heapq.heapify(queue)
+                self._changed.notify_all()
+        waited = time.monotonic() - started
+        rate_limit_wait_seconds.observe(
+            waited, upstream=upstream, priority=PRIORITY_NAMES[level]
+        )
+        return waited
+
+    async def aacquire(self, upstream, cost=1, level=None):
+        if upstream not in self.limits:
+            return 0.0
+        return await asyncio.to_thread(self.acquire, upstream, cost, level)
+
+    def throttled(self, upstream, seconds):
+        """Record a 429 from the upstream: hold back every request to it, in every process, for `seconds`."""
+        throttled_responses.inc(upstream=upstream)
+        if upstream in self.limits:
+            self.buckets.block(upstream, seconds)
+
+    def queue_depths(self):
+        with self._changed:
+            return {(name,): len(queue) for name, queue in self._queues.items()}
+
+
+rate_limiter = RateLimiter()
+
+registry.gauge(
+    "newsbot_ratelimit_queue_depth",
+    "Requests waiting for their upstream's rate limit in this process.",
+    ["upstream"],
+    rate_limiter.queue_depths,
+)
+
+
+### OPENAI
+
+
+def retry_after(error):
+    """Seconds OpenAI asked to wait in a rate limit error, or a short default."""
+    try:
+        return float(error.response.headers.get("retry-after", 1))
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+
+class ScheduledChatOpenAI(ChatOpenAI):
+    """ChatOpenAI that waits for the shared request and token budgets before each call, and for 429s to pass."""
+
+    def _cost(self, messages, kwargs):
+        prompt = sum(count_tokens(str(m.content)) for m in messages)
+        return prompt + (
+            kwargs.get("max_tokens") or self.max_tokens or COMPLETION_ESTIMATE
+        )
+
+    def _reserve(self, messages, kwargs):
+        rate_limiter.acquire("openai")
+        rate_limiter.acquire("openai_tokens", self._cost(messages, kwargs))
+
+    async def _areserve(self, messages, kwargs):
+        await rate_limiter.aacquire("openai")
+        await rate_limiter.aacquire("openai_tokens", self._cost(messages, kwargs))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        for throttled in range(MAX_THROTTLED + 1):
+            self._reserve(messages, kwargs)
+            try:
+                return super()._generate(messages, stop, run_manager, **kwargs)
+            except openai.RateLimitError as e:
+                if throttled == MAX_THROTTLED:
+                    raise
+                rate_limiter.throttled("openai", retry_after(e))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for throttled in range(MAX_THROTTLED + 1):
+            self._reserve(messages, kwargs)
+            started = False
+            try:
+                for chunk in super()._stream(messages, stop, run_manager, **kwargs):
+                    started = True
+                    yield chunk
+                return
+            except openai.RateLimitError as e:
+                # Only retried before the first chunk, so nothing is streamed twice
+                if started or throttled == MAX_THROTTLED:
+                    raise
+                rate_limiter.throttled("openai", retry_after(e))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        for throttled in range(MAX_THROTTLED + 1):
+            await self._areserve(messages, kwargs)
+            try:
+                return await super()._agenerate(messages, stop, run_manager, **kwargs)
+            except openai.RateLimitError as e:
+                if throttled == MAX_THROTTLED:
+                    raise
+                rate_limiter.throttled("openai", retry_after(e))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        for throttled in range(MAX_THROTTLED + 1):
+            await self._areserve(messages, kwargs)
+            started = False
+            try:
+                async for chunk in super()._astream(
+                    messages, stop, run_manager, **kwargs
+                ):
+                    started = True
+                    yield chunk
+                return
+            except openai.RateLimitError as e:
+                if started or throttled == MAX_THROTTLED:
+                    raise
+                rate_limiter.throttled("openai", retry_after(e))
@@ -0,0 +1,205 @@
+import hashlib
+import html
+import json
+import re
+import threading
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+import tiktoken
+from langchain_core.documents import Document
+
+### REDUCTION SETTINGS
+
+OBSERVATION_TOKEN_BUDGET = 800  # per tool observation sent back to the agent
+SUMMARY_TOKEN_BUDGET = 2000  # per article sent to the summariser
+MEMO_SIZE = 512
+
+TAG_RE = re.compile(r"<[^>]+>")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+WORD_RE = re.compile(r"[a-z0-9']+")
+STOPWORDS = {
+    "the", "and", "for", "that", "with", "this", "from", "have", "has", "was",
+    "were", "are", "but", "not", "his", "her", "their", "they", "been", "said",
+    "will", "would", "about", "after", "into", "which", "when", "what", "who",
+}  # fmt: skip
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    """The gpt-3.5 tokenizer, or None if its BPE file can't be loaded (e.g. offline)."""
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"Falling back to approximate token counts, exception: {e}")
+        return None
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, budget):
+    encoding = get_encoding()
+    if encoding is None:
+        return text[: budget * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:budget])
+
+
+def clean_text(text):
+    """Strip markup and entities and collapse whitespace."""
+    text = TAG_RE.sub("", html.unescape(text or ""))
+    return " ".join(text.split())
+
+
+def raw_observation(observation):
+    """The text the agent would have seen for this observation without reduction."""
+    if isinstance(observation, str):
+        return observation
+    try:
+        return json.dumps(observation)
+    except Exception:
+        return str(observation)
+
+
+def observation_items(observation):
+    """Split an observation into (header, body) pairs of plain text."""
+    if isinstance(observation, str):
+        return [("", clean_text(observation))]
+    if isinstance(observation, Document):
+        metadata = observation.metadata
+        header = " | ".join(
+            clean_text(str(metadata[k])) for k in ("title", "link") if metadata.get(k)
+        )
+        return [(header, clean_text(observation.page_content))]
+    if isinstance(observation, dict):
+        header = " | ".join(
+            clean_text(str(observation[k]))
+            for k in ("title", "url")
+            if observation.get(k)
+        )
+        body = " ".join(
+            clean_text(str(v))
+            for k, v in observation.items()
+            if k not in ("title", "url", "alternate_sources") and v
+        )
+        if observation.get("alternate_sources"):
+            header += " | also at " + ", ".join(observation["alternate_sources"])
+        return [(header, body)]
+    if isinstance(observation, (list, tuple)):
+        return [item for o in observation for item in observation_items(o)]
+    return [("", clean_text(str(observation)))]
+
+
+def select_sentences(text, budget, focus=""):
+    """Extractive reduction: keep the highest scoring sentences that fit in `budget` tokens, in their original order."""
+    if count_tokens(text) <= budget:
+        return text
+    sentences = [s for s in SENTENCE_RE.split(text) if s]
+    words = [
+        [w for w in WORD_RE.findall(s.lower()) if len(w) > 2 and w not in STOPWORDS]
+        for s in sentences
+    ]
+    frequency = Counter(w for ws in words for w in ws)
+    focus_words = set(WORD_RE.findall(focus.lower()))
+
+    def score(i):
+        if not words[i]:
+            return 0.0
+        base = sum(frequency[w] for w in words[i]) / len(words[i]) ** 0.5
+        base += 2 * len(focus_words.intersection(words[i]))
+        # Lead sentences of news copy carry the most information
+        return base * (1.5 if i < 2 else 1.0)
+
+    chosen, used = [], 0
+    for i in sorted(range(len(sentences)), key=score, reverse=True):
+        cost = count_tokens(sentences[i])
+        if used + cost > budget:
+            continue
+        chosen.append(i)
+        used += cost
+    if not chosen:
+        # A single run-on sentence longer than the budget: fall back to truncation
+        return truncate_tokens(text, budget)
+    return " ".join(sentences[i] for i in sorted(chosen))
+
+
+class Reduction:
+    __slots__ = ("text", "tokens_before", "tokens_after")
+
+    def __init__(self, text, tokens_before, tokens_after):
+        self.text = text
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+
+    @property
+    def tokens_saved(self):
+        return self.tokens_before - self.tokens_after
+
+
+class ContextReducer:
+    """Cleans, de-duplicates and trims tool observations to a token budget before they reach the model.
+
+    Reductions are memoised, since the agent rebuilds its scratchpad from every step on each iteration.
+    """
+
+    def __init__(self, budget=OBSERVATION_TOKEN_BUDGET, memo_size=MEMO_SIZE):
+        self.budget = budget
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reduce(self, observation):
+        raw = raw_observation(observation)
+        key = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+
+        items, seen = [], set()
+        for header, body in observation_items(observation):
+            fingerprint = " ".join(WORD_RE.findall(body.lower())) or header.lower()
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            items.append((header, body))
+
+        per_item = max(self.budget // max(len(items), 1), 1)
+        lines = []
+        for header, body in items:
+            body_budget = max(per_item - count_tokens(header), 16)
+            body = select_sentences(body, body_budget, header)
+            lines.append(f"{header}\n{body}" if header else body)
+        text = "\n\n".join(lines)
+        reduction = Reduction(text, count_tokens(raw), count_tokens(text))
+
+        with self._lock:
+            self._memo[key] = reduction
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return reduction
+
+    def reduce_steps(self, intermediate_steps):
+        """Replace every observation in (action, observation) steps with its reduced text."""
+        return [
+            (action, self.reduce(observation).text)
+            for action, observation in intermediate_steps
+        ]
+
+    def report(self, intermediate_steps):
+        """Token counts before and after reduction for a turn's steps."""
+        reductions = [self.reduce(observation) for _, observation in intermediate_steps]
+        before = sum(r.tokens_before for r in reductions)
+        after = sum(r.tokens_after for r in reductions)
+        return {
+            "tokens_before": before,
+            "tokens_after": after,
+            "tokens_saved": before - after,
+        }
+
+
+context_reducer = ContextReducer()
@@ -0,0 +1,47 @@
+import threading
+from functools import wraps
+
+from utils.config import setting
+
+_registry = {}
+# Re-entrant, since building one resource may need another
+_lock = threading.RLock()
+
+
+def shared(factory):
+    """Build a resource once per process and per set of arguments, on first use."""
+
+    @wraps(factory)
+    def wrapper(*args, **kwargs):
+        key = (
+            factory.__module__,
+            factory.__qualname__,
+            args,
+            tuple(sorted(kwargs.items())),
+        )
+        with _lock:
+            if key not in _registry:
+                _registry[key] = factory(*args, **kwargs)
+            return _registry[key]
+
+    return wrapper
+
+
+def built_resources():
+    """Names of the resources built so far in this process."""
+    with _lock:
+        return [f"{module}.{name}{args}" for module, name, args, _ in _registry]
+
+
+@shared
+def chat_model(model_name="gpt-3.5-turbo", temperature=0.7, tags=()):
+    """Shared OpenAI chat client; its HTTP connection pool and rate limits are shared by every caller."""
+    from utils.ratelimit import ScheduledChatOpenAI
+
+    return ScheduledChatOpenAI(
+        model_name=model_name,
+        temperature=temperature,
+        openai_api_key=setting("openai_api_key"),
+        openai_api_base=setting("openai_api_base", "https://api.openai.com/v1"),
+        tags=list(tags),
+    )
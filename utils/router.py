@@ -0,0 +1,253 @@
+import math
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from templates.routing_examples import routing_examples
+from utils.metrics import registry
+from utils.semantic_cache import FILLER, names_entity, names_subject
+
+### ROUTER SETTINGS
+
+ROUTE_THRESHOLD = 0.8  # run the tool without asking the model
+SPECULATE_THRESHOLD = 0.5  # start the tool's search while the model decides
+FAST_PATH_TOOLS = {"news_search", "answer_search", "get_api_headlines"}
+NB_ALPHA = 1.0
+NB_ONLY_WEIGHT = 0.75  # the classifier alone never reaches ROUTE_THRESHOLD
+BARE_WORDS = 4  # longest input read as a bare name or topic to look up in the news
+
+WORD_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9'.&-]*")
+NEWS_WORDS = {
+    "news", "latest", "headlines", "headline", "happening", "happened", "update",
+    "updates", "breaking", "today", "stories", "story", "going", "recent", "new",
+}  # fmt: skip
+# Small talk and requests that are not about the news at all, which the model answers without a tool
+CHAT_WORDS = {
+    "hello", "hi", "hey", "thanks", "thank", "thx", "ok", "okay", "cool", "great",
+    "nice", "bye", "goodbye", "yes", "no", "yeah", "nope", "sorry", "lol", "haha",
+    "never", "mind", "joke", "translate", "write", "poem", "repeat", "shorter",
+    "longer", "help", "test", "morning", "evening", "night", "you", "your",
+}  # fmt: skip
+# "us" as a pronoun rather than the country: "tell us about", "let us know"
+PRONOUN_US_RE = re.compile(
+    r"\b(let|tell|give|show|help|for|to|with|of) us\b", re.IGNORECASE
+)
+QUESTION_RE = re.compile(
+    r"^(who|what|whats|what's|where|when|how|why|which|define|explain)\b"
+)
+# Everything NewsAPI has top headlines for, by the names people use
+COUNTRY_CODES = {
+    "uae": "ae", "united arab emirates": "ae", "argentina": "ar", "austria": "at",
+    "australia": "au", "belgium": "be", "bulgaria": "bg", "brazil": "br", "canada": "ca",
+    "switzerland": "ch", "china": "cn", "colombia": "co", "cuba": "cu",
+    "czech republic": "cz", "czechia": "cz", "germany": "de", "egypt": "eg",
+    "france": "fr", "uk": "gb", "united kingdom": "gb", "britain": "gb", "england": "gb",
+    "greece": "gr", "hong kong": "hk", "hungary": "hu", "indonesia": "id",
+    "ireland": "ie", "israel": "il", "india": "in", "italy": "it", "japan": "jp",
+    "south korea": "kr", "korea": "kr", "lithuania": "lt", "latvia": "lv",
+    "morocco": "ma", "mexico": "mx", "malaysia": "my", "nigeria": "ng",
+    "netherlands": "nl", "norway": "no", "new zealand": "nz", "philippines": "ph",
+    "poland": "pl", "portugal": "pt", "romania": "ro", "serbia": "rs", "russia": "ru",
+    "saudi arabia": "sa", "sweden": "se", "singapore": "sg", "slovenia": "si",
+    "slovakia": "sk", "thailand": "th", "turkey": "tr", "taiwan": "tw",
+    "ukraine": "ua", "us": "us", "usa": "us", "united states": "us", "america": "us",
+    "venezuela": "ve", "south africa": "za",
+}  # fmt: skip
+COUNTRY_RE = re.compile(
+    r"\b("
+    + "|".join(sorted(map(re.escape, COUNTRY_CODES), key=len, reverse=True))
+    + r")\b"
+)
+# The words of a request for news, and instructions on the answer, that are not part of its subject
+TOPIC_FILLER = (
+    FILLER
+    | NEWS_WORDS
+    | {"from", "top", "going", "on", "whats", "and", "let", "know", "summarise"}
+    | {"summarize", "summary", "sources", "source", "citing", "cite", "links"}
+)
+
+routes = registry.counter(
+    "newsbot_router_decisions",
+    "Router decisions by predicted tool and path: direct, speculative or model.",
+    ["tool", "path"],
+)
+
+
+@dataclass
+class Route:
+    tool: str
+    tool_input: dict = field(default_factory=dict)
+    confidence: float = 0.0
+    reason: str = ""
+    # Taken only when the classifier predicts the same tool
+    needs_agreement: bool = False
+
+
+def words(text):
+    return [w.lower() for w in WORD_RE.findall(text)]
+
+
+def features(text):
+    tokens = words(text)
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def topic(text):
+    """The question with the words about asking for news removed, keeping the original casing."""
+    text = PRONOUN_US_RE.sub(r"\1", text)
+    kept = [
+        w for w in WORD_RE.findall(text) if w.lower().rstrip(".") not in TOPIC_FILLER
+    ]
+    return " ".join(kept).rstrip(".")
+
+
+def is_small_talk(tokens):
+    """A few words of greeting, thanks or talk to the assistant itself: "ok", "how are you"."""
+    return len(tokens) <= BARE_WORDS and bool(CHAT_WORDS.intersection(tokens))
+
+
+def find_country(text):
+    """(ISO code, matched name) of a country named in the text, or (None, None)."""
+    match = COUNTRY_RE.search(PRONOUN_US_RE.sub(r"\1", text.lower()))
+    if match is None:
+        return None, None
+    return COUNTRY_CODES[match.group(1)], match.group(1)
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes over words and word pairs."""
+
+    def __init__(self, examples, alpha=NB_ALPHA):
+        self.alpha = alpha
+        self.priors = Counter(label for _, label in examples)
+        self.counts = defaultdict(Counter)
+        for text, label in examples:
+            self.counts[label].update(features(text))
+        self.totals = {label: sum(c.values()) for label, c in self.counts.items()}
+        self.vocabulary = {f for c in self.counts.values() for f in c}
+
+    def predict(self, text):
+        """Probability of each label."""
+        total = sum(self.priors.values())
+        scores = {}
+        for label, prior in self.priors.items():
+            denominator = self.totals[label] + self.alpha * len(self.vocabulary)
+            score = math.log(prior / total)
+            for f in features(text):
+                if f in self.vocabulary:
+                    score += math.log(
+                        (self.counts[label][f] + self.alpha) / denominator
+                    )
+            scores[label] = score
+        top = max(scores.values())
+        exps = {label: math.exp(score - top) for label, score in scores.items()}
+        norm = sum(exps.values())
+        return {label: value / norm for label, value in exps.items()}
+
+
+def rule_route(text):
+    """Route from the routing rules in the prompt's examples, or None when no rule applies."""
+    lowered = text.lower().strip(" ?!.")
+    tokens = words(lowered)
+    asks_news = any(w in NEWS_WORDS for w in tokens)
+    code, country = find_country(lowered)
+    rest = (
+        topic(COUNTRY_RE.sub(" ", PRONOUN_US_RE.sub(r"\1", lowered)))
+        if country
+        else None
+    )
+
+    if country and not rest and (asks_news or len(tokens) <= 3):
+        return Route("get_api_headlines", {"countrycode": code}, 0.95, "country news")
+    if QUESTION_RE.search(lowered) and not asks_news:
+        return Route("answer_search", {"query": text.strip()}, 0.9, "factual question")
+    if asks_news:
+        subject = topic(text)
+        if not subject:
+            return None
+        if " and " in f" {lowered} ":
+            # Several subjects read better from every source at once
+            return Route(
+                "news_search", {"query": subject}, 0.6, "news on several subjects"
+            )
+        return Route("news_search", {"query": subject}, 0.9, "news about a subject")
+    if " and " in f" {lowered} " and len(tokens) <= 6:
+        return Route("answer_search", {"query": text.strip()}, 0.85, "two subjects")
+    if 1 <= len(tokens) <= BARE_WORDS and not QUESTION_RE.search(lowered):
+        subject = topic(text)
+        if not subject:
+            return None
+        if names_entity(text, CHAT_WORDS):
+            return Route("news_search", {"query": subject}, 0.85, "bare name")
+        # A few lowercase words may be small talk rather than a topic: only the classifier can tell
+        return Route(
+            "news_search", {"query": subject}, 0.85, "bare topic", needs_agreement=True
+        )
+    return None
+
+
+class Router:
+    """Predicts the agent's first tool call from the question alone, with a confidence score.
+
+    Rules taken from the prompt's examples decide; a naive Bayes classifier trained on labelled questions
+    confirms them, and routes on its own, at lower confidence, when no rule applies.
+    """
+
+    def __init__(self, examples=routing_examples):
+        self.classifier = NaiveBayes(examples)
+
+    def route(self, text, history=()):
+        """The predicted Route, or None when the model should decide."""
+        if not text.strip():
+            return None
+        # Mid-chat, "Why?" or "How many were killed?" only make sense with the conversation: the model decides
+        if history and not names_subject(text):
+            return None
+        if is_small_talk(words(text)) and not NEWS_WORDS.intersection(words(text)):
+            return None
+        # "thanks for the update", "great news, thanks": news words, but nothing to search for once they go
+        subject = words(topic(text))
+        if subject and CHAT_WORDS.issuperset(subject):
+            return None
+        probabilities = self.classifier.predict(text)
+        predicted = max(probabilities, key=probabilities.get)
+        rule = rule_route(text)
+        if rule is not None:
+            if rule.needs_agreement and predicted != rule.tool:
+                return None
+            if predicted != rule.tool:
+                rule.confidence *= 0.5 + 0.5 * probabilities.get(rule.tool, 0.0)
+            return rule
+
+        if predicted == "none":
+            return None
+        confidence = probabilities[predicted] * NB_ONLY_WEIGHT
+        if predicted == "get_api_headlines":
+            code, _ = find_country(text)
+            if code is None:
+                return None
+            return Route(predicted, {"countrycode": code}, confidence, "classifier")
+        if predicted == "news_search":
+            return Route(
+                predicted, {"query": topic(text) or text}, confidence, "classifier"
+            )
+        if predicted == "answer_search":
+            return Route(predicted, {"query": text.strip()}, confidence, "classifier")
+        return Route(predicted, {}, confidence, "classifier")
+
+    def decide(self, text, history=()):
+        """(route, path): path is direct, speculative or model."""
+        route = self.route(text, history)
+        if route is None or route.tool not in FAST_PATH_TOOLS:
+            path = "model"
+        elif route.confidence >= ROUTE_THRESHOLD:
+            path = "direct"
+        elif route.confidence >= SPECULATE_THRESHOLD:
+            path = "speculative"
+        else:
+            path = "model"
+        routes.inc(tool=route.tool if route else "none", path=path)
+        return route, path
+
+
+router = Router()
@@ -0,0 +1,218 @@
+import hashlib
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from utils.metrics import semantic_cache_lookup_seconds
+
+### SEMANTIC CACHE SETTINGS
+
+DIMENSIONS = 512
+MAX_ENTRIES = 4096
+SIMILARITY_THRESHOLD = 0.85
+ANSWER_TTL = 600  # seconds a cached answer is served; matches the news_search cache
+CHAR_NGRAM = 3
+CHAR_NGRAM_WEIGHT = (
+    0.5  # relative to whole words, so typos still match but words dominate
+)
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+NAME_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9'.&-]*")
+URL_RE = re.compile(r"https?://[^\s)\]>\"']+")
+# Words that say how a question is asked rather than what it is about
+FILLER = {
+    "a", "an", "the", "of", "on", "in", "at", "to", "for", "with", "about", "is",
+    "are", "was", "were", "what", "whats", "what's", "happened", "happening",
+    "latest", "news", "today", "now", "update", "updates", "new", "any", "tell",
+    "me", "give", "show", "please", "can", "you", "could", "there", "story",
+    "stories", "recent", "recently", "current", "currently", "going",
+}  # fmt: skip
+# Questions that lean on the conversation so far, whose answer depends on more than the question
+FOLLOW_UP = {
+    "it", "its", "it's", "that", "this", "these", "those", "they", "them",
+    "their", "he", "she", "him", "her", "his", "more", "else", "above",
+    "first", "second", "third", "previous", "again", "same",
+}  # fmt: skip
+# Words of a question that don't name its subject: "Why?", "How many died?", "What did I just ask you?"
+QUESTION_WORDS = {
+    "who", "why", "how", "when", "where", "which", "many", "much", "did", "do",
+    "does", "done", "i", "i'm", "my", "we", "our", "us", "your", "just", "ask",
+    "asked", "say", "said", "so", "mean", "meant", "really", "exactly", "then",
+    "also", "too", "other", "one", "ones", "be", "been", "has", "have", "had",
+    "will", "would", "should", "not", "and", "or", "but", "get", "got",
+}  # fmt: skip
+MIN_SUBJECT_TERMS = 2  # content words that name a subject without an entity
+
+
+def content_terms(question):
+    return [w for w in WORD_RE.findall(question.lower()) if w not in FILLER]
+
+
+def is_follow_up(question):
+    return any(w in FOLLOW_UP for w in WORD_RE.findall(question.lower()))
+
+
+def names_entity(text, ignore=()):
+    """Whether the text has a proper noun or entity-like word: capitalised after the first word, an acronym
+    or a number. Words in `ignore` never count."""
+    for i, word in enumerate(NAME_RE.findall(text)):
+        if word.lower() in ignore:
+            continue
+        if (i and word[0].isupper()) or (len(word) > 1 and word.isupper()):
+            return True
+        if any(c.isdigit() for c in word):
+            return True
+    return False
+
+
+def names_subject(question):
+    """Whether a question says what it is about on its own, without the conversation before it."""
+    if is_follow_up(question):
+        return False
+    terms = {t for t in content_terms(question) if t not in QUESTION_WORDS}
+    return names_entity(question, QUESTION_WORDS) or len(terms) >= MIN_SUBJECT_TERMS
+
+
+def history_digest(messages):
+    """Digest of the conversation a question was asked in; None for the first question of a chat."""
+    if not messages:
+        return None
+    digest = hashlib.sha1()
+    for message in messages:
+        digest.update(f"{message.type}:{message.content}\n".encode())
+    return digest.hexdigest()
+
+
+def embed(question, dimensions=DIMENSIONS):
+    """Hashed bag of words and character n-grams, L2-normalised; all zeros for an empty question."""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for term in content_terms(question):
+        vector[zlib.crc32(term.encode()) % dimensions] += 1.0
+        padded = f" {term} "
+        for i in range(len(padded) - CHAR_NGRAM + 1):
+            gram = "#" + padded[i : i + CHAR_NGRAM]
+            vector[zlib.crc32(gram.encode()) % dimensions] += CHAR_NGRAM_WEIGHT
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def citations(answer):
+    """The links cited in an answer, in order of first appearance."""
+    return list(dict.fromkeys(url.rstrip(".,;") for url in URL_RE.findall(answer)))
+
+
+class SemanticCache:
+    """Recent answers indexed by question embedding and intent, with a TTL and LRU eviction.
+
+    The intent, such as the tool a question is routed to, must match too: the words that tell "Who is Taylor
+    Swift?" from "latest news about Taylor Swift" are filler to the embedding. So must the conversation: the cache
+    is shared by every session, and a question asked mid-chat is only cached when it names its subject, and then
+    only for the same conversation.
+
+    Vectors live in one preallocated matrix with a column per entry. A question only has a few dozen non-zero
+    features, so a lookup multiplies just those rows, not the whole matrix.
+    """
+
+    def __init__(
+        self,
+        max_entries=MAX_ENTRIES,
+        dimensions=DIMENSIONS,
+        threshold=SIMILARITY_THRESHOLD,
+        ttl=ANSWER_TTL,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.dimensions = dimensions
+        self._vectors = np.zeros((dimensions, max_entries), dtype=np.float32)
+        self._expires_at = np.zeros(max_entries)  # 0 marks a free slot
+        self._used_at = np.zeros(max_entries)
+        self._intents = np.zeros(max_entries, dtype=np.int64)
+        self._entries = [None] * max_entries
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "skipped": 0, "stores": 0}
+
+    def _intent_id(self, intent, history):
+        """63-bit key of the intent and conversation; hashed so that no table of them grows with every chat."""
+        key = repr((intent, history_digest(history))).encode()
+        return int.from_bytes(hashlib.sha1(key).digest()[:8], "big") >> 1
+
+    def _best(self, vector, intent_id, now):
+        """Slot and similarity of the closest live entry with the same intent, or (None, 0)."""
+        features = np.flatnonzero(vector)
+        scores = vector[features] @ self._vectors[features]
+        scores[(self._expires_at <= now) | (self._intents != intent_id)] = -1.0
+        slot = int(np.argmax(scores))
+        if scores[slot] < 0:
+            return None, 0.0
+        return slot, float(scores[slot])
+
+    def cacheable(self, question, history=()):
+        if history and not names_subject(question):
+            return False
+        return bool(content_terms(question)) and not is_follow_up(question)
+
+    def lookup(self, question, intent=None, history=()):
+        """The cached entry for a near-identical recent question with the same intent and history, or None."""
+        if not self.cacheable(question, history):
+            with self._lock:
+                self._counters["skipped"] += 1
+            return None
+        started = time.perf_counter()
+        vector = embed(question, self.dimensions)
+        now = time.time()
+        with self._lock:
+            intent_id = self._intent_id(intent, history)
+            slot, similarity = self._best(vector, intent_id, now)
+            hit = slot is not None and similarity >= self.threshold
+            if hit:
+                self._used_at[slot] = now
+                entry = dict(self._entries[slot], similarity=similarity)
+            self._counters["hits" if hit else "misses"] += 1
+        semantic_cache_lookup_seconds.observe(time.perf_counter() - started)
+        return entry if hit else None
+
+    def add(self, question, answer, intent=None, history=()):
+        """Cache an answer; one to a near-identical question with the same intent and history is replaced."""
+        if not self.cacheable(question, history) or not answer:
+            return
+        vector = embed(question, self.dimensions)
+        now = time.time()
+        entry = {
+            "question": question,
+            "answer": answer,
+            "citations": citations(answer),
+            "created_at": now,
+        }
+        with self._lock:
+            intent_id = self._intent_id(intent, history)
+            slot, similarity = self._best(vector, intent_id, now)
+            if slot is None or similarity < self.threshold:
+                # A free or expired slot, or else the least recently used one
+                free = np.flatnonzero(self._expires_at <= now)
+                slot = int(free[0]) if len(free) else int(np.argmin(self._used_at))
+            self._vectors[:, slot] = vector
+            self._intents[slot] = intent_id
+            self._expires_at[slot] = now + self.ttl
+            self._used_at[slot] = now
+            self._entries[slot] = entry
+            self._counters["stores"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._expires_at[:] = 0
+            self._entries = [None] * len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            size = int(np.count_nonzero(self._expires_at > time.time()))
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"]
+        return dict(
+            counters, size=size, hit_rate=counters["hits"] / lookups if lookups else 0.0
+        )
+
+
+semantic_cache = SemanticCache()
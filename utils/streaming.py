@@ -0,0 +1,51 @@
+import asyncio
+import queue
+import threading
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+AGENT_LLM_TAG = "agent_llm"
+_DONE = object()
+
+
+def iter_events(runnable, input, config=None, **kwargs):
+    """Run `runnable.astream_events` on a background event loop and yield its events synchronously.
+
+    Streamlit can only render from the script thread, so the async stream is drained into a queue there.
+    """
+    events = queue.Queue()
+
+    async def consume():
+        async for event in runnable.astream_events(
+            input, config, version="v1", **kwargs
+        ):
+            events.put(event)
+
+    def run():
+        try:
+            asyncio.run(consume())
+        except BaseException as e:
+            events.put(e)
+        finally:
+            events.put(_DONE)
+
+    thread = threading.Thread(target=run, daemon=True, name="agent-events")
+    # Let code running on the agent thread use Streamlit APIs that need the script's context
+    add_script_run_ctx(thread)
+    thread.start()
+    while True:
+        event = events.get()
+        if event is _DONE:
+            return
+        if isinstance(event, BaseException):
+            raise event
+        yield event
+
+
+def answer_token(event):
+    """The text of a token streamed by the agent's model, or None for any other event."""
+    if event["event"] != "on_chat_model_stream":
+        return None
+    if AGENT_LLM_TAG not in event.get("tags", []):
+        return None
+    return event["data"]["chunk"].content or None
@@ -1,12 +1,32 @@
-import wikipedia, requests
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from datetime import datetime, timezone
 from typing import List
 from pydantic import BaseModel, Field
-from langchain.agents import tool
-from langchain_openai import ChatOpenAI
-from langchain_community.document_loaders import NewsURLLoader, BraveSearchLoader
-import streamlit as st
+from langchain_core.tools import tool
+from langchain_core.documents import Document
+from utils.archive import archive
+from utils.article_store import article_store, canonical_url, content_hash
+from utils.cache import cached
+from utils.config import setting
+from utils.dedup import DocumentClusterer, aliases, dedupe_results
+from utils.http_client import http_client
+from utils.reduce import SUMMARY_TOKEN_BUDGET, clean_text, select_sentences
+from utils.resources import chat_model
+
+NEWSAPI_BASE_URL = setting("newsapi_base_url", "https://newsapi.org/v2")
+BRAVE_BASE_URL = setting("brave_base_url", "https://api.search.brave.com/res/v1")
+
 
 ### NEWSAPI HEADLINES TOOL
+def newsapi_result(article):
+    return {
+        "title": article["title"],
+        "url": article["url"],
+        "description": article.get("description") or "",
+        "published": article.get("publishedAt"),
+    }
 
 
 class CountryCodeInput(BaseModel):
@@ -15,27 +35,30 @@ class CountryCodeInput(BaseModel):
     )
 
 
-@tool(args_schema=CountryCodeInput)
-def get_api_headlines(countrycode):
-    """Gets webpage links of latest headlines about a country. Use this tool when user cites the name of a country. Use 'web_retriever' to load the webpage links to read the content."""
-    BASE_URL = "https://newsapi.org/v2/top-headlines?"
+@cached("get_api_headlines")
+def fetch_api_headlines(countrycode):
+    BASE_URL = f"{NEWSAPI_BASE_URL}/top-headlines?"
+    params = {
+        "apiKey": setting("newsapi_api_key"),
+        "country": countrycode,
+        "pageSize": 5,
+    }
 
-    try:
-        params = {
-            "apiKey": st.secrets["newsapi_api_key"],
-            "country": countrycode,
-            "pageSize": 5,
-        }
+    response = http_client.get(BASE_URL, params, upstream="newsapi")
+    response.raise_for_status()
+    response = response.json()
+    if response["totalResults"] == 0:
+        return "No headlines found"
+    results = [newsapi_result(i) for i in response["articles"]]
+    archive.add_results(results, "newsapi_headlines")
+    return results
 
-        response = requests.get(BASE_URL, params)
-        response = response.json()
-        news = []
-        if response["totalResults"] == 0:
-            return "No headlines found"
-        else:
-            news = [i["url"] for i in response["articles"]]
-            return news
 
+@tool(args_schema=CountryCodeInput)
+def get_api_headlines(countrycode):
+    """Gets webpage links of latest headlines about a country. Use this tool when user cites the name of a country. Use 'webpage_retriever' to load the webpage links to read the content."""
+    try:
+        return dedupe_results(fetch_api_headlines(countrycode))
     except Exception as e:
         return f"An error has occurred: {e}"
 
@@ -45,26 +68,30 @@ class NewsInput(BaseModel):
     query: str = Field(..., description="Query to search the news for")
 
 
+@cached("get_api_news")
+def fetch_api_news(query):
+    BASE_URL = f"{NEWSAPI_BASE_URL}/everything?"
+    params = {
+        "apiKey": setting("newsapi_api_key"),
+        "q": query,
+        "pageSize": 5,
+    }
+
+    response = http_client.get(BASE_URL, params, upstream="newsapi")
+    response.raise_for_status()
+    response = response.json()
+    if response["totalResults"] == 0:
+        return "No latest news found"
+    results = [newsapi_result(i) for i in response["articles"]]
+    archive.add_results(results, "newsapi_everything")
+    return results
+
+
 @tool(args_schema=NewsInput)
 def get_api_news(query):
-    """Gets webpage links of news about a personality, issue or event. Use this tool when user asks for the latest news or headlines about a personality, issue or event. Use 'web_retriever' to load the webpage links to read the content."""
-    BASE_URL = "https://newsapi.org/v2/everything?"
+    """Gets webpage links of news about a personality, issue or event. Use this tool when user asks for the latest news or headlines about a personality, issue or event. Use 'webpage_retriever' to load the webpage links to read the content."""
     try:
-        params = {
-            "apiKey": st.secrets["newsapi_api_key"],
-            "q": query,
-            "pageSize": 5,
-        }
-
-        response = requests.get(BASE_URL, params)
-        response = response.json()
-        news = []
-        if response["totalResults"] == 0:
-            return "No latest news found"
-        else:
-            news = [i["url"] for i in response["articles"]]
-            return news
-
+        return dedupe_results(fetch_api_news(query))
     except Exception as e:
         return f"An error has occurred: {e}"
 
@@ -74,17 +101,35 @@ class SearchInput(BaseModel):
     query: str = Field(..., description="query to search for")
 
 
+@cached("answer_search")
+def fetch_answer_search(query):
+    BASE_URL = f"{BRAVE_BASE_URL}/web/search"
+    params = {"q": query, "count": 5}
+    headers = {
+        "Accept": "application/json",
+        "X-Subscription-Token": setting("brave_api_key"),
+    }
+    response = http_client.get(
+        BASE_URL, params=params, headers=headers, upstream="brave"
+    )
+    response.raise_for_status()
+    results = response.json().get("web", {}).get("results", [])
+    docs = [
+        Document(
+            page_content=r.get("description", ""),
+            metadata={"title": r.get("title"), "link": r.get("url")},
+        )
+        for r in results
+    ]
+    archive.add_results(docs, "brave_web")
+    return docs
+
+
 @tool(args_schema=SearchInput)
 def answer_search(query):
     """Search the internet for answers based on the query. Use this tool when user asks a question about a personality, issue or event."""
     try:
-        loader = BraveSearchLoader(
-            query=query,
-            api_key=st.secrets["brave_api_key"],
-            search_kwargs={"count": 5},
-        )
-        docs = loader.load()
-        return docs
+        return fetch_answer_search(query)
     except Exception as e:
         return f"An error has occurred: {e}"
 
@@ -92,51 +137,343 @@ def answer_search(query):
 ### BRAVE SEARCH NEWS TOOL
 
 
+@cached("news_search")
+def fetch_news_search(query):
+    BASE_URL = f"{BRAVE_BASE_URL}/news/search"
+    params = {
+        "q": query,
+        "count": 5,
+        "search_lang": "en",
+    }
+
+    headers = {
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip",
+        "X-Subscription-Token": setting("brave_api_key"),
+    }
+    response = http_client.get(
+        BASE_URL, params=params, headers=headers, upstream="brave"
+    )
+    response.raise_for_status()
+    results = response.json()["results"]
+    news = []
+    for r in results:
+        news.append(
+            {
+                "title": r["title"],
+                "url": r["url"],
+                "description": r["description"],
+                "published": r.get("page_age"),
+            }
+        )
+    archive.add_results(news, "brave_news")
+    return news
+
+
 @tool(args_schema=SearchInput)
 def news_search(query):
     """Search the internet for latest news based on the query. Use this tool when user asks for latest news about a personality, issue or event."""
     try:
-        BASE_URL = "https://api.search.brave.com/res/v1/news/search"
-        params = {
-            "q": query,
-            "count": 5,
-            "search_lang": "en",
+        return dedupe_results(fetch_news_search(query))
+    except Exception as e:
+        return f"An error has occurred: {e}"
+
+
+### MULTI-SOURCE NEWS TOOL
+RRF_K = 60
+RECENCY_HALF_LIFE = 24  # hours
+RECENCY_WEIGHT = 0.5
+MAX_RESULTS = 8
+# Seconds after the fan-out starts by which each source must have answered
+SOURCE_DEADLINES = {
+    "brave_news": 4,
+    "brave_web": 4,
+    "newsapi_everything": 5,
+    "newsapi_headlines": 3,
+}
+search_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="multi-search")
+
+
+@cached("top_headlines_search")
+def fetch_api_top_headlines(query):
+    BASE_URL = f"{NEWSAPI_BASE_URL}/top-headlines?"
+    params = {
+        "apiKey": setting("newsapi_api_key"),
+        "q": query,
+        "pageSize": 5,
+    }
+
+    response = http_client.get(BASE_URL, params, upstream="newsapi")
+    response.raise_for_status()
+    response = response.json()
+    results = [newsapi_result(i) for i in response["articles"]]
+    archive.add_results(results, "newsapi_headlines")
+    return results
+
+
+def fetch_web_results(query):
+    return [
+        {
+            "title": doc.metadata["title"],
+            "url": doc.metadata["link"],
+            "description": doc.page_content,
         }
+        for doc in fetch_answer_search(query)
+    ]
+
+
+SOURCES = {
+    "brave_news": fetch_news_search,
+    "brave_web": fetch_web_results,
+    "newsapi_everything": fetch_api_news,
+    "newsapi_headlines": fetch_api_top_headlines,
+}
+
+
+def parse_published(value):
+    if not value:
+        return None
+    try:
+        published = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        return None
+    if published.tzinfo is None:
+        published = published.replace(tzinfo=timezone.utc)
+    return published
+
 
-        headers = {
-            "Accept": "application/json",
-            "Accept-Encoding": "gzip",
-            "X-Subscription-Token": st.secrets["brave_api_key"],
+def fuse_results(ranked_lists, now=None):
+    """Merge ranked result lists with reciprocal-rank fusion, boosted by how recent each story is."""
+    now = now or datetime.now(timezone.utc)
+    merged = {}
+    for source, results in ranked_lists.items():
+        for rank, result in enumerate(results):
+            key = canonical_url(result["url"])
+            if key not in merged:
+                merged[key] = dict(result, sources=[], score=0.0)
+            merged[key]["sources"].append(source)
+            merged[key]["score"] += 1 / (RRF_K + rank + 1)
+
+    for result in merged.values():
+        published = parse_published(result.get("published"))
+        if published is not None:
+            age = max((now - published).total_seconds() / 3600, 0)
+            result["score"] *= 1 + RECENCY_WEIGHT * 0.5 ** (age / RECENCY_HALF_LIFE)
+
+    fused = sorted(merged.values(), key=lambda r: r["score"], reverse=True)
+    for result in fused:
+        del result["score"]
+    return fused
+
+
+@tool(args_schema=SearchInput)
+def multi_search(query):
+    """Search Brave news, Brave web and NewsAPI at the same time and get one ranked list of results, each tagged with the sources that returned it. Use this tool for broad news questions, or when another search returned few results."""
+    try:
+        start = time.monotonic()
+        futures = {
+            source: search_pool.submit(contextvars.copy_context().run, fetch, query)
+            for source, fetch in SOURCES.items()
         }
-        response = requests.get(BASE_URL, params=params, headers=headers)
-        results = response.json()["results"]
-        news = []
-        for r in results:
-            news.append(
-                {"title": r["title"], "url": r["url"], "description": r["description"]}
-            )
-        return news
+        ranked_lists = {}
+        for source, future in futures.items():
+            remaining = start + SOURCE_DEADLINES[source] - time.monotonic()
+            try:
+                results = future.result(timeout=max(remaining, 0))
+            except TimeoutError:
+                print(
+                    f"Skipping {source}, no answer within {SOURCE_DEADLINES[source]}s"
+                )
+                continue
+            except Exception as e:
+                print(f"Skipping {source}, exception: {e}")
+                continue
+            if isinstance(results, list):
+                ranked_lists[source] = results
+        if not ranked_lists:
+            return "No latest news found"
+        return dedupe_results(fuse_results(ranked_lists))[:MAX_RESULTS]
+    except Exception as e:
+        return f"An error has occurred: {e}"
+
+
+### ARCHIVE SEARCH TOOL
+class ArchiveInput(BaseModel):
+    query: str = Field(..., description="query to search the archive for")
+    max_age_hours: int = Field(
+        48, description="Only return stories from the last this many hours"
+    )
+
+
+@tool(args_schema=ArchiveInput)
+def archive_search(query, max_age_hours=48):
+    """Search the stories already found by the other tools, including the text of webpages already read. It is instant and uses no web search, so use this tool first for follow-up questions and for news likely to have been searched recently. If it finds nothing relevant or recent enough, use the other tools."""
+    try:
+        results = archive.search(query, max_age_hours)
+        if not results:
+            return "No archived stories found"
+        return results
     except Exception as e:
         return f"An error has occurred: {e}"
 
 
 ### WEBPAGE RETRIEVER TOOL
+PAGE_TIMEOUT = 10  # overall deadline for a single page download, retries included
+ARTICLE_FRESH = 1800  # seconds a stored page is reused without revalidating it
+RETRIEVER_TIMEOUT = 30  # overall deadline for a webpage_retriever call, downloads and summaries together
+fetch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="webpage-fetch")
+summary_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="webpage-summary")
+
+
+SUMMARY_PROMPT = "Summarise this article.\n\nTitle: {title}\nURL: {link}\n\n{text}"
+SUMMARY_PROMPT_HASH = content_hash(SUMMARY_PROMPT)
+
+
+def load_article(url, deadline=None):
+    """Download a page through the shared HTTP client and extract it with newspaper3k.
+
+    Pages already in the article store are reused as they are while fresh, then revalidated with a conditional GET.
+    The download gives up after PAGE_TIMEOUT seconds, or at the `deadline` (a time.monotonic() value) if sooner.
+    """
+    stored = article_store.get_article(url)
+    if stored and time.time() - stored["fetched_at"] < ARTICLE_FRESH:
+        return Document(page_content=stored["text"], metadata=stored["metadata"])
+    headers = {}
+    if stored and stored["etag"]:
+        headers["If-None-Match"] = stored["etag"]
+    if stored and stored["last_modified"]:
+        headers["If-Modified-Since"] = stored["last_modified"]
+
+    page_deadline = time.monotonic() + PAGE_TIMEOUT
+    response = http_client.get(
+        url,
+        headers=headers,
+        timeout=(http_client.timeout[0], PAGE_TIMEOUT),
+        deadline=page_deadline if deadline is None else min(deadline, page_deadline),
+    )
+    if response.status_code == 304 and stored:
+        article_store.revalidated(url)
+        return Document(page_content=stored["text"], metadata=stored["metadata"])
+    response.raise_for_status()
+
+    # newspaper3k is slow to import and only needed once a page is actually read
+    from newspaper import Article
+
+    article = Article(url)
+    article.download(input_html=response.text)
+    article.parse()
+    metadata = {
+        "title": article.title,
+        "link": article.url or article.canonical_link,
+        "authors": article.authors,
+        "language": article.meta_lang,
+        "description": article.meta_description,
+        "publish_date": article.publish_date,
+    }
+    article_store.put_article(
+        url,
+        article.text,
+        metadata,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+    )
+    archive.add(
+        [
+            {
+                "url": url,
+                "title": article.title,
+                "body": article.text,
+                "published": article.publish_date,
+                "source": "webpage",
+            }
+        ]
+    )
+    return Document(page_content=article.text, metadata=metadata)
+
+
+def time_left(deadline):
+    return max(deadline - time.monotonic(), 0)
+
+
+def summarise_article(model, doc):
+    """Summarise a page, reusing the stored summary if the same text was summarised before."""
+    text_hash = content_hash(doc.page_content)
+    summary = article_store.get_summary(text_hash, SUMMARY_PROMPT_HASH)
+    if summary is None:
+        title = doc.metadata.get("title") or ""
+        text = select_sentences(
+            clean_text(doc.page_content), SUMMARY_TOKEN_BUDGET, title
+        )
+        prompt = SUMMARY_PROMPT.format(
+            title=title, link=doc.metadata.get("link") or "", text=text
+        )
+        summary = model.invoke(prompt).content
+        article_store.put_summary(text_hash, SUMMARY_PROMPT_HASH, summary)
+    return summary
+
+
 class UrlListInput(BaseModel):
     url_list: List[str] = Field(..., description="List of url links to web pages")
 
 
 @tool(args_schema=UrlListInput)
 def webpage_retriever(url_list):
-    """Use this to load and read the news websites from the 'answer_search' and 'news_search' tools"""
+    """Use this to load and read the news websites from the 'answer_search', 'news_search', 'multi_search', 'get_api_headlines' and 'archive_search' tools"""
     summaries = []
-    model = ChatOpenAI(openai_api_key=st.secrets["openai_api_key"])
+    model = chat_model()
+    # One deadline for the whole call, so a slow page can't hold up both the downloads and the summaries
+    deadline = time.monotonic() + RETRIEVER_TIMEOUT
     try:
-        # Load website
-        loader = NewsURLLoader(url_list)
-        docs = loader.load()  # list
-        for i in docs:
-            summary = model.invoke(f"Summarise {i}")
-            summaries.append(summary)
+        # Skip URLs already known to carry the same story as another URL in the list, citing them with it
+        stories = {}
+        skipped = {}
+        for url in url_list:
+            story = canonical_url(aliases.resolve(url))
+            if story in stories:
+                skipped.setdefault(stories[story], []).append(url)
+            else:
+                stories[story] = url
+        clusterer = DocumentClusterer()
+
+        # Download all pages at once and hand each one to the model as soon as it is parsed
+        fetches = {
+            fetch_pool.submit(
+                contextvars.copy_context().run, load_article, url, deadline
+            ): url
+            for url in stories.values()
+        }
+        pending = {}
+        try:
+            for fetch in as_completed(fetches, timeout=time_left(deadline)):
+                url = fetches[fetch]
+                try:
+                    doc = fetch.result()
+                except Exception as e:
+                    print(f"Error fetching or processing {url}, exception: {e}")
+                    continue
+                if not clusterer.add(doc):
+                    continue
+                pending[
+                    summary_pool.submit(
+                        contextvars.copy_context().run, summarise_article, model, doc
+                    )
+                ] = (doc, url)
+        except TimeoutError:
+            print("Skipping pages that did not load in time")
+
+        # Summaries are returned in the order they finish
+        try:
+            for summary in as_completed(pending, timeout=time_left(deadline)):
+                doc, url = pending[summary]
+                link = doc.metadata.get("link")
+                try:
+                    alternates = clusterer.alternates(link) + skipped.get(url, [])
+                    sources = ", ".join([link] + alternates)
+                    summaries.append(f"{summary.result()}\n\nSources: {sources}")
+                except Exception as e:
+                    print(f"Error summarising {link}, exception: {e}")
+        except TimeoutError:
+            print("Skipping summaries that did not finish in time")
         return summaries
     except Exception as e:
         return f"An error has occurred: {e}"
@@ -150,6 +487,8 @@ class WikiInput(BaseModel):
 @tool(args_schema=WikiInput)
 def wikipedia_search(query):
     """Run Wikipedia search and get page summaries. Only use this tool as a last resort if there are no news results available."""
+    import wikipedia
+
     page_titles = wikipedia.search(query)  # Returns a list of page titles
     if page_titles:
         print(f"No of page titles: {len(page_titles)}. The list has {page_titles}")